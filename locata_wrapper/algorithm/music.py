@@ -3,14 +3,27 @@
 # Apache 2.0  (http://www.apache.org/licenses/LICENSE-2.0)
 from argparse import Namespace
 from collections import OrderedDict
-import librosa
+from functools import partial
 import logging
 import numpy as np
-from scipy.ndimage.filters import maximum_filter
-from scipy.signal import find_peaks
+from scipy.ndimage import maximum_filter
+from scipy.spatial.transform import Rotation
+from scipy.spatial.transform import Slerp
 import sys
+import timeit
 
+from locata_wrapper.utils.parallel import map_block_chunks
+from locata_wrapper.utils.profiling import GetProfiler
+from locata_wrapper.utils.shared import sph2cart
 from locata_wrapper.utils.shared import wrapToPi
+from locata_wrapper.utils.steering import steering_cache
+from locata_wrapper.utils.steering import steering_vectors
+from locata_wrapper.utils.stft import fft_frequencies
+from locata_wrapper.utils.stft import samples_to_time
+from locata_wrapper.utils.stft import stft
+
+# Number of blocks between exact recomputations of the sliding covariance
+SLIDING_RESET = 100
 
 
 def MUSIC(inputs, options, log=logging):
@@ -27,17 +40,21 @@ def MUSIC(inputs, options, log=logging):
         in.time:                6xT matrix of system clock times
         in.array.rotation:      Rotation matrix describing array orientation in 3D for each timestamp
         in.array.mic:           Matrix describing microphone positions for each timestamp
+        in.profiler:            Profiler of the stages (optional, see locata_wrapper.utils.profiling)
+        in.stft:                Precomputed STFT of the signal (optional, see music_stft), used when its
+                                settings match and it covers the subarray and the frequency band
     opts:                     Settings structure generated by init()
 
     Outputs:
     out:
-        out.source:             N x 1 struct array, one element for each N estimated sources. In this function: N = 1
-                                (single-source)
+        out.source:             N x 1 struct array, one element for each N estimated sources. In this function:
+                                N = options.music.num_sources
         out.source(src_idx).azimuth:      Tx1 vector of azimuth estimates, where T is the number of timestamps
                                           in in.timestamps
         out.source(src_idx).elevation:    Tx1 vector of elevation estimates
         out.source(src_idx).time:         Tx1 vector of system time values of estimates (must be identical to in.time!)
         out.source(src_idx).timestamps:   Tx1 vector of timestamps of estimates (must be identical to in.timestamps!)
+        out.spectrum:           Per-frequency pseudo-spectrum of the blocks (only with options.music.keep_spectrum)
 
     References:
         [1]    J. Benesty, C. Jingdong, and I. Cohen, Design of Circular Differential Microphone Arrays.
@@ -47,34 +64,97 @@ def MUSIC(inputs, options, log=logging):
         [3]    H. L. Van Trees, Detection, Estimation, and Modulation Theory, Optimum Array Processing. John Wiley
                & Sons, 2004.
     """
-    az = np.linspace(-np.pi, np.pi, 73)  # Resolution of azimuth: 5 dg
-    el = np.linspace(0, np.pi, 19)  # Resolution of elevation: 10 dg
-
-    if inputs.array_name == 'dicit':
-        subarray = np.array([6, 7, 9])
-        ref_mic = 1
-    elif inputs.array_name == 'benchmark2':
-        subarray = np.arange(12).astype(np.int)
-        ref_mic = 1
-    elif inputs.array_name == 'eigenmike':
-        subarray = np.arange(32).astype(np.int)
-        ref_mic = 1
-    elif inputs.array_name == 'dummy':
-        subarray = np.arange(4).astype(np.int)
-        ref_mic = 1
-    else:
-        log.error('Array type {} does not exists'.format(inputs.array_name))
-        sys.exit(1)
+    music_opts = options.music
+    profiler = GetProfiler(inputs, log)
+    az = np.linspace(*np.radians(music_opts.azimuth_range), music_opts.num_azimuth)
+    el = np.linspace(*np.radians(music_opts.elevation_range), music_opts.num_elevation)
+
+    # -> STFT, covariance and subspace stages
+    sub = music_subspaces(inputs, options, log)
+    subarray, ref_mic, pose_idx = sub.subarray, sub.ref_mic, sub.pose_idx
+    block_timestamps, valid_freq, Un, valid_block = sub.block_timestamps, sub.freq, sub.Un, sub.valid_block
+    opti_rotation, opti_mics = sub.rotation, sub.mic
+    nblocks = block_timestamps.shape[0]
+
+    cache_stats = steering_cache.stats()
+    with profiler.stage('spectrum', memory=music_opts.memory_report or None):
+        # Spectrum summed over the valid frequencies, accumulated block by block:
+        outputs = dict(spectrum=np.zeros([nblocks, az.shape[0], el.shape[0]]))
+        if music_opts.keep_spectrum:
+            outputs['power'] = np.zeros([nblocks, valid_freq.shape[0], az.shape[0], el.shape[0]])
+        map_block_chunks(partial(_spectrum_chunk, array_name=inputs.array_name, subarray=subarray, ref_mic=ref_mic,
+                                 c=options.c),
+                         nblocks, dict(Un=Un, valid=valid_block, pose_idx=pose_idx, rotation=opti_rotation,
+                                       mic=opti_mics, az=az, el=el, freq=valid_freq),
+                         outputs, music_opts.workers, music_opts.backend, log=log)
+        _spectrum = outputs['spectrum']
+    log.info('Steering cache: {} hits, {} misses'.format(steering_cache.hits - cache_stats.hits,
+                                                         steering_cache.misses - cache_stats.misses))
+
+    # -> Find DOA
+    with profiler.stage('peaks'):
+        if music_opts.search == 'hierarchical':
+            # Refine the coarse estimates around the strongest peaks of each block:
+            mics = opti_mics[:, pose_idx][:, :, subarray]
+            azimuth, elevation, evaluations = hierarchical_search(
+                _spectrum, az, el, Un, valid_freq, opti_rotation[:, pose_idx].transpose(1, 0, 2),
+                mics.transpose(1, 0, 2), mics[:, :, ref_mic].T, options.c, valid_block,
+                max(music_opts.refine_peaks, music_opts.num_sources), np.radians(music_opts.target_resolution),
+                music_opts.num_sources)
+            log.info('Hierarchical search: {} grid evaluations per block instead of {} ({} saved)'.format(
+                evaluations.evaluated, evaluations.full_grid, evaluations.full_grid - evaluations.evaluated))
+        else:
+            # Strongest regional maxima of every block:
+            azimuth, elevation, _ = find_doa_peaks(_spectrum, az, el, music_opts.num_sources)
+
+    with profiler.stage('interpolation'):
+        out = output_sources(inputs, block_timestamps, azimuth, elevation)
+    if music_opts.search == 'hierarchical':
+        out.grid_evaluations = evaluations
+    if music_opts.keep_spectrum:
+        # Diagnostics: B x F x A x E pseudo-spectrum of the valid frequencies
+        out.spectrum = Namespace(power=outputs['power'], block_timestamps=block_timestamps, freq=valid_freq,
+                                 azimuth=az, elevation=el)
+    return out
+
+
+def music_subspaces(inputs, options, log=logging):
+    """STFT, covariance and subspace stages shared by the subspace methods
+
+    Inputs:
+        inputs:     Input structure of MUSIC
+        options:    Settings structure, options.music contains the MUSIC settings
+
+    Outputs:
+        sub:                    Namespace containing
+        sub.subarray:           Indexes of the microphones used
+        sub.ref_mic:            Index in subarray of the reference microphone
+        sub.block_timestamps:   Vector of B timestamps (center) of the blocks
+        sub.freq:               Vector of F frequencies of the band-limited bins [Hz]
+        sub.Un:                 B x F x M x K noise subspaces
+        sub.valid_block:        Vector of B flags, False for blocks of less than two frames
+        sub.pose_idx:           Vector of B indexes of the pose (in sub.rotation and sub.mic) of each block
+        sub.rotation:           3 x T x 3 rotation matrices of the unique OptiTrack samples
+                                (of the blocks with options.music.pose = 'interpolate')
+        sub.mic:                3 x T x M microphone positions of the unique OptiTrack samples
+                                (of the blocks with options.music.pose = 'interpolate')
+    """
+    music_opts = options.music
+    profiler = GetProfiler(inputs, log)
+    subarray = music_subarray(inputs.array_name, inputs.array.mic.shape[2], music_opts, log)
+    ref_mic = music_opts.ref_mic
 
     # MUSIC
     numMic = subarray.shape[0]
+    noise_dim = noise_subspace_dim(numMic, music_opts)
 
-    fftPoint = 1024
-    frame_duration = 0.03
-    frames_per_block = 100  # Number of frames per block
-    block_step = 10
+    fftPoint = music_opts.fft_point
+    frame_duration = music_opts.frame_duration
+    frames_per_block = music_opts.frames_per_block  # Number of frames per block
+    block_step = music_opts.block_step
 
     frame_length = int(frame_duration * inputs.fs)
+    hop_length = frame_length // music_opts.hops_per_frame
 
     # -> OptiTracker sampling rate
 
@@ -84,119 +164,248 @@ def MUSIC(inputs, options, log=logging):
     opti_mics = inputs.array.mic[:, unique_idx]
 
     duration = inputs.y.shape[0]
-    inputs.y = np.asfortranarray(inputs.y)
-
-    # -> STFT
-    X = np.stack([librosa.stft(inputs.y[:, ch],
-                               n_fft=fftPoint,
-                               hop_length=frame_length // 4,
-                               win_length=fftPoint,
-                               window='hamming',
-                               pad_mode='reflect') for ch in subarray], axis=1)
-    X = X.transpose(2, 0, 1)
-    frame_timestamp = librosa.samples_to_time(np.arange(0, duration, frame_length // 4),
-                                              sr=inputs.fs)
-    fft_freq = librosa.fft_frequencies(sr=inputs.fs, n_fft=fftPoint)
+
+    # Bandlimit signals to avoid spatial aliasing / low freq effects:
+    # NOTE: This is crucial for the DICIT array, the other arrays can be
+    # evaluated for fullband signals.
+    valid_freq_idx = band_bins(inputs.fs, music_opts)
+    valid_freq = fft_frequencies(inputs.fs, fftPoint)[valid_freq_idx]
+
+    # -> STFT of all the channels of the subarray, band-limited bins only
+    # (sliced from the precomputed inputs.stft when it covers them):
+    shared = getattr(inputs, 'stft', None)
+    if shared is not None and shared.key == stft_key(music_opts, inputs.fs) and \
+            np.all(np.isin(subarray, shared.channels)) and np.all(np.isin(valid_freq_idx, shared.bins)):
+        valid_X = shared.X[:, _index_of(shared.bins, valid_freq_idx)][:, :, _index_of(shared.channels, subarray)]
+    else:
+        with profiler.stage('stft'):
+            valid_X = music_stft(inputs.y, inputs.fs, subarray, valid_freq_idx, music_opts).X
+    frame_timestamp = samples_to_time(np.arange(0, duration, hop_length), inputs.fs)
 
     nframe = frame_timestamp.shape[0]
 
     # Check that the frame times and Optitracker times intersect:
-    opti_timestamps = opti_timestamps[opti_timestamps < frame_timestamp[-1]]
+    opti_valid = opti_timestamps < frame_timestamp[-1]
+    opti_timestamps = opti_timestamps[opti_valid]
+    opti_rotation = opti_rotation[:, opti_valid]
+    opti_mics = opti_mics[:, opti_valid]
 
     # -> MUSIC
     # Make blocks out of frames:
     frame_srt = np.arange(0, nframe - 1, block_step)
     frame_end = np.arange(frames_per_block, nframe, block_step)
     frame_end = np.pad(frame_end, (0, frame_srt.shape[0] - frame_end.shape[0]), 'constant', constant_values=nframe - 1)
-    nblocks = frame_srt.shape[0]
 
     block_timestamps = np.mean([frame_timestamp[frame_srt], frame_timestamp[frame_end]], axis=0)
-    # Bandlimit signals to avoid spatial aliasing / low freq effects:
-    # NOTE: This is crucial for the DICIT array, the other arrays can be
-    # evaluated for fullband signals.
-    valid_freq_idx = (800 < fft_freq) * (fft_freq < 1400)
-    valid_freq = fft_freq[valid_freq_idx]
-    valid_X = X[:, valid_freq_idx]
 
-    _power = np.zeros([fftPoint // 2 - 1, az.shape[0], el.shape[0], nblocks])
-    for block_idx in range(nblocks):
-        for freq_idx in range(valid_freq.shape[0]):  # fftPoint/2-1
-            # Block of FFT frames:
-            # print(freq_idx, block_idx)
-            data_block = np.squeeze(valid_X[frame_srt[block_idx]:frame_end[block_idx], freq_idx, :])
-            if data_block.shape[0] > 1:  # ensure svd does not result in empty U
-                # Find nearest OptiTrac sample:
-                _diff = block_timestamps[block_idx] - opti_timestamps
-                closest_opti_idx = np.argmin(_diff)
-                # Autocorrelation
-                Rxx = np.dot(data_block.T, np.conj(data_block))
-
-                # Rxx = U * S * U^H, see [3] eq. (9.32)
-                U, _, _ = np.linalg.svd(Rxx)
-
-                # [3] eq. (9.37), using spectral sparsity assumption:
-                # Signal subspace is 1 dimensional if 1 source is active, hence D = 1
-                Un = U[:, 1:]
-                
-                for a_idx in range(az.shape[0]):
-                    for e_idx in range(el.shape[0]):
-                        az_idx = az[a_idx]
-                        el_idx = el[e_idx]
-                        # [2] eq (8.35) modified s.th. az = 0 and el = pi/2 result in eta = [0 1 0],
-                        #  i.e., pointing along y-axis:
-                        eta = np.array([-np.sin(el_idx) * np.sin(az_idx), np.sin(el_idx) * np.cos(az_idx), np.cos(el_idx)])[:, None]
-                        rot_eta = np.dot(np.squeeze(opti_rotation[:, closest_opti_idx, :]), eta)
-
-                        # [2] eq (8.36) - TDoA:
-                        tau = 1 / options.c * np.dot(rot_eta.T, np.squeeze(opti_mics[:, closest_opti_idx, subarray]) - 
-                            np.repeat(opti_mics[:, closest_opti_idx:closest_opti_idx + 1, subarray[ref_mic]], numMic, axis=1))
-
-                        # [2] eq (8.34) - Steering vector:
-                        SV = np.exp(1j * 2 * np.pi * valid_freq[freq_idx] * tau).T
-
-                        # [3] eq. (9.44):
-                        _power[freq_idx, a_idx, e_idx, block_idx] = 1. / np.sum(
-                            np.abs(np.linalg.multi_dot([SV.conj().T, Un, Un.conj().T, SV])))
-    # Sum spectra over all frequencies:
-    _spectrum = _power.sum(0).transpose(2, 0, 1)
+    # Covariance stage: autocorrelation of every (block, frequency) pair
+    valid_X = valid_X.astype(music_opts.dtype, copy=False)
+    if music_opts.covariance not in ['sliding', 'direct']:
+        log.error('Covariance estimator {} does not exists'.format(music_opts.covariance))
+        sys.exit(1)
 
-    # -> Find DOA
-    # NOTE: Single-source assumption
-    azimuth = np.full([nblocks], np.nan)
-    elevation = np.full([nblocks], np.nan)
+    # Subspace stage: Rxx = U * S * U^H, see [3] eq. (9.32)
+    # [3] eq. (9.37), using spectral sparsity assumption:
+    # Signal subspace is D dimensional if D sources are active (noise_dim, checked above)
+    nblocks = frame_srt.shape[0]
+    # seconds: time of the covariance and subspace stages of each chunk (on its first block)
+    outputs = dict(Un=np.zeros([nblocks, valid_freq.shape[0], numMic, noise_dim], dtype=valid_X.dtype),
+                   valid=np.zeros([nblocks], dtype=bool), seconds=np.zeros([nblocks, 2]))
+    # Chunks of blocks are aligned to the resets of the sliding estimator, so the
+    # result does not depend on the number of workers:
+    with profiler.stage('subspaces'):
+        map_block_chunks(partial(_subspace_chunk, covariance=music_opts.covariance, noise_dim=noise_dim),
+                         nblocks, dict(X=valid_X, frame_srt=frame_srt, frame_end=frame_end), outputs,
+                         music_opts.workers, music_opts.backend,
+                         align=SLIDING_RESET if music_opts.covariance == 'sliding' else 1, log=log)
+    Un, valid_block = outputs['Un'], outputs['valid']
+    # Time spent by the workers in each stage:
+    chunks = int(np.count_nonzero(outputs['seconds'][:, 0]))
+    profiler.add('covariance', outputs['seconds'][:, 0].sum(), calls=chunks)
+    profiler.add('subspace', outputs['seconds'][:, 1].sum(), calls=chunks)
 
-    for block_idx in range(nblocks):
-        if _spectrum.shape[2] == 1:
-            # find_peak code for 1 elevation
-            locs = find_peaks(_spectrum[block_idx, :])
-            if len(locs) > 0:
-                azimuth[block_idx] = az[locs[0]]
-        else:
-            mesh_spec = np.squeeze(_spectrum[block_idx, :, :])
-
-            # Extract regional maxima:
-            lm = maximum_filter(mesh_spec, 1)
-            # Global maximum:
-            loc = np.argmax(lm)
-            loc_az, loc_el = np.unravel_index(loc, mesh_spec.shape)
-            azimuth[block_idx] = az[loc_az]
-            elevation[block_idx] = el[loc_el]
-
-    # -> Interpolate estimates to OptiTracker timestamps
-    # Interpolate MUSIC estimates to required time stamps:
-    # Use left np.NaN to be compatible with the matlab code.
-    interp_azimuth = np.interp(inputs.timestamps, block_timestamps, azimuth, left=np.NaN)
-    interp_elevation = np.interp(inputs.timestamps, block_timestamps, elevation, left=np.NaN)
+    # Array pose of each block (OptiTrack sample closest to its center or interpolated):
+    pose_idx, opti_rotation, opti_mics = block_poses(block_timestamps, opti_timestamps, opti_rotation, opti_mics,
+                                                     music_opts.pose)
+
+    return Namespace(subarray=subarray, ref_mic=ref_mic, block_timestamps=block_timestamps,
+                     freq=valid_freq, Un=Un, valid_block=valid_block, pose_idx=pose_idx,
+                     rotation=opti_rotation, mic=opti_mics)
+
+
+def nearest_samples(timestamps, query):
+    """Index of the closest element of a sorted vector of timestamps for each query timestamp"""
+    if timestamps.shape[0] < 2:
+        return np.zeros(query.shape, dtype=int)
+    idx = np.clip(np.searchsorted(timestamps, query), 1, timestamps.shape[0] - 1)
+    return np.where(query - timestamps[idx - 1] <= timestamps[idx] - query, idx - 1, idx)
+
+
+def block_poses(block_timestamps, opti_timestamps, rotation, mic, pose='nearest'):
+    """Array pose of each block
+
+    Inputs:
+        block_timestamps:   Vector of B timestamps of the blocks
+        opti_timestamps:    Sorted vector of T timestamps of the OptiTrack samples
+        rotation:           3 x T x 3 rotation matrices of the OptiTrack samples
+        mic:                3 x T x M microphone positions of the OptiTrack samples
+        pose:               'nearest' (closest OptiTrack sample) or 'interpolate' (slerp of the
+                            rotations and linear interpolation of the microphone positions between
+                            the two samples around the block, the first / last sample outside them)
+
+    Outputs:
+        pose_idx:           Vector of B indexes of the pose of each block in rotation and mic
+        rotation:           3 x T x 3 rotation matrices (3 x B x 3 for 'interpolate')
+        mic:                3 x T x M microphone positions (3 x B x M for 'interpolate')
+    """
+    num_samples = opti_timestamps.shape[0]
+    if pose == 'nearest' or num_samples < 2:
+        return nearest_samples(opti_timestamps, block_timestamps), rotation, mic
+
+    right = np.searchsorted(opti_timestamps, block_timestamps)
+    left = np.clip(right - 1, 0, num_samples - 1)
+    right = np.clip(right, 0, num_samples - 1)
+    span = opti_timestamps[right] - opti_timestamps[left]
+    weight = np.clip((block_timestamps - opti_timestamps[left]) / np.where(span > 0, span, 1), 0, 1)
+    weight[span <= 0] = 0
+
+    block_mic = mic[:, left] + weight[None, :, None] * (mic[:, right] - mic[:, left])
+    slerp = Slerp(opti_timestamps, Rotation.from_matrix(rotation.transpose(1, 0, 2)))
+    block_rotation = slerp(np.clip(block_timestamps, opti_timestamps[0], opti_timestamps[-1])).as_matrix()
+    block_rotation = block_rotation.transpose(1, 0, 2)
+
+    # Blocks at a sample or between two equal poses (static array) keep the measured pose,
+    # so their steering tables are shared (see locata_wrapper.utils.steering):
+    sample = np.where(weight < 1, left, right)
+    exact = (weight == 0) + (weight == 1) + np.all(rotation[:, left] == rotation[:, right], axis=(0, 2)) * \
+        np.all(mic[:, left] == mic[:, right], axis=(0, 2))
+    block_rotation[:, exact] = rotation[:, sample[exact]]
+    block_mic[:, exact] = mic[:, sample[exact]]
+    return np.arange(block_timestamps.shape[0]), block_rotation, block_mic
+
+
+def band_bins(fs, music_opts):
+    """Indexes of the FFT bins within music_opts.freq_band (bounds excluded)"""
+    fft_freq = fft_frequencies(fs, music_opts.fft_point)
+    return np.flatnonzero((music_opts.freq_band[0] < fft_freq) * (fft_freq < music_opts.freq_band[1]))
+
+
+def stft_key(music_opts, fs):
+    """Settings of the STFT of MUSIC, configurations with the same key can share their STFT"""
+    hop_length = int(music_opts.frame_duration * fs) // music_opts.hops_per_frame
+    return (music_opts.fft_point, hop_length, music_opts.band_dft, music_opts.stft_dtype)
+
+
+def music_stft(y, fs, channels, bins, music_opts):
+    """STFT stage of MUSIC
+
+    Inputs:
+        y:          N x M signal (or LazyAudio handle)
+        fs:         Sampling frequency [Hz]
+        channels:   Indexes of the channels transformed
+        bins:       Indexes of the bins kept
+        music_opts: MUSIC settings (fft_point, frame_duration, hops_per_frame, band_dft, stft_dtype)
+
+    Outputs:
+        stft:           Namespace containing
+        stft.X:         T x F x M spectra of the bins and channels
+        stft.channels:  Indexes of the channels
+        stft.bins:      Indexes of the bins
+        stft.key:       Settings of the STFT (see stft_key)
+    """
+    key = stft_key(music_opts, fs)
+    fftPoint, hop_length = key[:2]
+    channels, bins = np.asarray(channels), np.asarray(bins)
+    if music_opts.band_dft:
+        X = stft(y[:, channels], fftPoint, hop_length, window='hamming', bins=bins, dtype=music_opts.stft_dtype)
+    else:
+        X = stft(y[:, channels], fftPoint, hop_length, window='hamming', dtype=music_opts.stft_dtype)[:, bins]
+    return Namespace(X=X, channels=channels, bins=bins, key=key)
+
+
+def _index_of(values, subset):
+    """Positions of the elements of subset in values"""
+    order = np.argsort(values)
+    return order[np.searchsorted(values, subset, sorter=order)]
+
+
+def _subspace_chunk(inputs, outputs, srt, end, covariance, noise_dim):
+    """Covariance and subspace stages of the blocks srt to end (see map_block_chunks)"""
+    start_time = timeit.default_timer()
+    if covariance == 'sliding':
+        Rxx, valid = sliding_block_covariances(inputs['X'], inputs['frame_srt'][srt:end], inputs['frame_end'][srt:end])
+    else:
+        Rxx, valid = block_covariances(inputs['X'], inputs['frame_srt'][srt:end], inputs['frame_end'][srt:end])
+    covariance_time = timeit.default_timer()
+    outputs['Un'][srt:end] = noise_subspace(Rxx, noise_dim)
+    outputs['valid'][srt:end] = valid
+    outputs['seconds'][srt] = [covariance_time - start_time, timeit.default_timer() - covariance_time]
+
+
+def _spectrum_chunk(inputs, outputs, srt, end, array_name, subarray, ref_mic, c):
+    """Spectrum scan of the blocks srt to end (see map_block_chunks)"""
+    for block_idx in srt + np.flatnonzero(inputs['valid'][srt:end]):
+        closest_opti_idx = inputs['pose_idx'][block_idx]
+
+        # Steering vectors of the whole grid for the array pose of this block
+        SV = steering_cache.get(array_name, subarray, ref_mic, inputs['rotation'][:, closest_opti_idx, :],
+                                inputs['mic'][:, closest_opti_idx, :], inputs['az'], inputs['el'], inputs['freq'], c)
+
+        # [3] eq. (9.44):
+        power = pseudo_spectrum(inputs['Un'][block_idx], SV)
+        outputs['spectrum'][block_idx] = power.sum(0)
+        if 'power' in outputs:
+            outputs['power'][block_idx] = power
+
+
+def music_subarray(array_name, num_mics, music_opts, log=logging):
+    """Indexes of the microphones used for an array
+
+    Inputs:
+        array_name:     String containing array name
+        num_mics:       Number of microphones of the array
+        music_opts:     MUSIC settings (options.music)
+
+    Outputs:
+        subarray:       Vector of indexes of the microphones used
+    """
+    if array_name not in music_opts.subarray:
+        log.error('Array type {} does not exists'.format(array_name))
+        sys.exit(1)
+    if music_opts.subarray[array_name] is None:
+        return np.arange(num_mics)
+    return np.array(music_opts.subarray[array_name])
+
+
+def output_sources(inputs, block_timestamps, azimuth, elevation):
+    """Interpolate block estimates to the required timestamps
+
+    Inputs:
+        inputs:             Input structure of MUSIC
+        block_timestamps:   Vector of B timestamps of the estimates
+        azimuth:            B x N azimuth estimates of N sources (or vector for a single source) [rad]
+        elevation:          B x N elevation estimates of N sources (or vector for a single source) [rad]
+
+    Outputs:
+        out:                Namespace with the output structure of MUSIC
+    """
+    azimuth = np.reshape(azimuth, [block_timestamps.shape[0], -1])
+    elevation = np.reshape(elevation, [block_timestamps.shape[0], -1])
 
     # Output 1 - interpolated
-    N_sources = 1
+    N_sources = azimuth.shape[1]
     out = Namespace()
     out.source = list()
-    for _ in range(N_sources):
-        noNaN = ~np.isnan(interp_azimuth)
-        interp_azimuth[noNaN] = wrapToPi(interp_azimuth[noNaN])
-        noNaN = ~np.isnan(interp_elevation)
-        interp_elevation[noNaN] = wrapToPi(interp_elevation[noNaN])
+    for src_idx in range(N_sources):
+        # -> Interpolate estimates to OptiTracker timestamps
+        # Interpolate MUSIC estimates to required time stamps:
+        # Use left np.nan to be compatible with the matlab code.
+        interp_azimuth = np.interp(inputs.timestamps, block_timestamps, azimuth[:, src_idx], left=np.nan)
+        interp_elevation = np.interp(inputs.timestamps, block_timestamps, elevation[:, src_idx], left=np.nan)
+
+        # NaN (before the first block) are passed through:
+        wrapToPi(interp_azimuth, out=interp_azimuth)
+        wrapToPi(interp_elevation, out=interp_elevation)
         results = dict(
             year=inputs.time.dt.year,
             month=inputs.time.dt.month,
@@ -210,3 +419,262 @@ def MUSIC(inputs, options, log=logging):
             )
         out.source.append(results)
     return out
+
+
+def block_covariances(X, frame_srt, frame_end):
+    """Spatial autocorrelation matrices of blocks of STFT frames
+
+    Inputs:
+        X:          T x F x M STFT (frames x frequencies x channels)
+        frame_srt:  Vector of B first frames of each block
+        frame_end:  Vector of B end frames (excluded) of each block
+
+    Outputs:
+        Rxx:        B x F x M x M autocorrelation matrices
+        valid:      Vector of B flags, False for blocks of less than two frames
+    """
+    nblocks = frame_srt.shape[0]
+    Rxx = np.zeros([nblocks, X.shape[1], X.shape[2], X.shape[2]], dtype=X.dtype)
+    valid = (frame_end - frame_srt) > 1  # ensure the noise subspace is not empty
+    for block_idx in np.flatnonzero(valid):
+        data_block = X[frame_srt[block_idx]:frame_end[block_idx]]
+        Rxx[block_idx] = np.matmul(data_block.transpose(1, 2, 0), data_block.conj().transpose(1, 0, 2))
+    return Rxx, valid
+
+
+def sliding_block_covariances(X, frame_srt, frame_end, reset_every=SLIDING_RESET):
+    """Spatial autocorrelation matrices of overlapping blocks of STFT frames
+
+    Recursive version of block_covariances: the covariance of a block is obtained from
+    the previous one by adding the outer products of the frames entering the block and
+    removing those of the frames leaving it, so each frame is processed twice instead of
+    frames_per_block / block_step times.
+    The running sum is kept in double precision and recomputed from scratch every
+    reset_every blocks to bound the round-off drift. The relative difference (Frobenius
+    norm) to block_covariances stays below 1e-10 for complex128 inputs, for complex64
+    inputs it is dominated by the single precision of the direct path (~1e-6).
+
+    Inputs:
+        X:              T x F x M STFT (frames x frequencies x channels)
+        frame_srt:      Vector of B first frames of each block (non-decreasing)
+        frame_end:      Vector of B end frames (excluded) of each block (non-decreasing)
+        reset_every:    Number of blocks between exact recomputations of the running sum
+
+    Outputs:
+        Rxx:            B x F x M x M autocorrelation matrices
+        valid:          Vector of B flags, False for blocks of less than two frames
+    """
+    def outer(data):
+        data = data.astype(np.complex128, copy=False)
+        return np.matmul(data.transpose(1, 2, 0), data.conj().transpose(1, 0, 2))
+
+    nblocks = frame_srt.shape[0]
+    Rxx = np.zeros([nblocks, X.shape[1], X.shape[2], X.shape[2]], dtype=X.dtype)
+    valid = (frame_end - frame_srt) > 1  # ensure the noise subspace is not empty
+    _srt, _end = 0, 0
+    for block_idx in range(nblocks):
+        srt, end = frame_srt[block_idx], frame_end[block_idx]
+        if block_idx % reset_every == 0 or srt < _srt or end < _end or srt >= _end:
+            _R = outer(X[srt:end])
+        else:
+            _R += outer(X[_end:end])
+            _R -= outer(X[_srt:srt])
+        _srt, _end = srt, end
+        if valid[block_idx]:
+            Rxx[block_idx] = _R
+    return Rxx, valid
+
+
+def noise_subspace_dim(num_mics, music_opts):
+    """Dimension of the noise subspace of a subarray
+
+    Inputs:
+        num_mics:       Number M of microphones of the subarray
+        music_opts:     MUSIC settings (see locata_wrapper.utils.opts.MUSICOptions)
+
+    Outputs:
+        noise_dim:      music_opts.noise_dim, or M - music_opts.num_sources if it is None
+
+    Raises a ValueError unless num_sources < M and 0 < noise_dim <= M - num_sources.
+    """
+    if music_opts.num_sources >= num_mics:
+        raise ValueError('num_sources ({}) should be smaller than the number of microphones of the subarray '
+                         '({})'.format(music_opts.num_sources, num_mics))
+    max_dim = num_mics - music_opts.num_sources
+    noise_dim = music_opts.noise_dim if music_opts.noise_dim is not None else max_dim
+    if not 0 < noise_dim <= max_dim:
+        raise ValueError('noise_dim ({}) should be between 1 and {} for {} microphones and {} sources'.format(
+            noise_dim, max_dim, num_mics, music_opts.num_sources))
+    return noise_dim
+
+
+def noise_subspace(Rxx, noise_dim):
+    """Noise subspace of a stack of autocorrelation matrices
+
+    The matrices are Hermitian, so a single batched eigendecomposition replaces
+    one SVD per matrix.
+
+    Inputs:
+        Rxx:        ... x M x M autocorrelation matrices
+        noise_dim:  Dimension K of the noise subspace
+
+    Outputs:
+        Un:         ... x M x K eigenvectors of the K smallest eigenvalues
+    """
+    _, U = np.linalg.eigh(Rxx)
+    # Eigenvalues are returned in ascending order:
+    return U[..., :noise_dim]
+
+
+def regional_maxima(spectrum, az):
+    """Regional maxima of pseudo-spectra
+
+    A grid point is a regional maximum if it is not smaller than its 8 neighbours. The
+    azimuth axis is circular when the grid covers the whole circle, then the duplicated
+    last azimuth (az[-1] = az[0] + 2 * pi) is merged with the first one.
+
+    Inputs:
+        spectrum:   B x A x E pseudo-spectra
+        az:         Vector of A azimuth angles of the grid [rad]
+
+    Outputs:
+        peaks:      B x A x E pseudo-spectra with -inf on the points which are not regional maxima
+    """
+    circular = az.shape[0] > 2 and np.isclose(az[-1] - az[0], 2 * np.pi)
+    if not circular:
+        lm = maximum_filter(spectrum, size=(1, 3, 3), mode='nearest')
+        return np.where(spectrum == lm, spectrum, -np.inf)
+
+    # Merge the duplicated azimuth, keep the location of the largest value:
+    last = spectrum[:, -1] > spectrum[:, 0]
+    folded = spectrum[:, :-1].copy()
+    folded[:, 0] = np.maximum(spectrum[:, 0], spectrum[:, -1])
+    lm = maximum_filter(folded, size=(1, 3, 3), mode=['nearest', 'wrap', 'nearest'])
+    peaks = np.full(spectrum.shape, -np.inf)
+    peaks[:, :-1] = np.where(folded == lm, folded, -np.inf)
+    peaks[:, -1] = np.where(last, peaks[:, 0], -np.inf)
+    peaks[:, 0] = np.where(last, -np.inf, peaks[:, 0])
+    return peaks
+
+
+def find_doa_peaks(spectrum, az, el, num_sources):
+    """Strongest regional maxima of pseudo-spectra
+
+    Inputs:
+        spectrum:       B x A x E pseudo-spectra
+        az:             Vector of A azimuth angles of the grid [rad]
+        el:             Vector of E elevation angles of the grid [rad]
+        num_sources:    Number N of peaks extracted from each spectrum
+
+    Outputs:
+        azimuth:        B x N azimuth of the peaks sorted by decreasing power [rad], NaN for missing peaks
+        elevation:      B x N elevation of the peaks [rad], NaN for missing peaks
+        power:          B x N power of the peaks, -inf for missing peaks
+    """
+    nblocks = spectrum.shape[0]
+    peaks = regional_maxima(spectrum, az).reshape(nblocks, -1)
+    # Stable sort, on ties the first grid point is kept as np.argmax does:
+    loc = np.argsort(-peaks, axis=1, kind='stable')[:, :num_sources]
+    power = np.take_along_axis(peaks, loc, axis=1)
+    loc_az, loc_el = np.unravel_index(loc, spectrum.shape[1:])
+    found = np.isfinite(power)
+    return np.where(found, az[loc_az], np.nan), np.where(found, el[loc_el], np.nan), power
+
+
+def hierarchical_search(spectrum, az, el, Un, freq, rotation, mics, ref_mic, c, valid, num_peaks, resolution,
+                        num_sources=1):
+    """Coarse-to-fine DOA search
+
+    The strongest regional maxima of the coarse pseudo-spectrum are refined on 3 x 3 local
+    grids whose step is halved at each level until the target resolution is reached. Refined
+    peaks closer than a coarse grid step to a stronger one are discarded.
+
+    Inputs:
+        spectrum:       B x A x E pseudo-spectrum of the coarse grid (summed over frequencies)
+        az:             Vector of A azimuth angles of the coarse grid [rad]
+        el:             Vector of E elevation angles of the coarse grid [rad]
+        Un:             B x F x M x K noise subspaces
+        freq:           Vector of F frequencies [Hz]
+        rotation:       B x 3 x 3 rotation matrices of the array
+        mics:           B x 3 x M microphone positions
+        ref_mic:        B x 3 reference microphone positions
+        c:              Speed of sound [m/s]
+        valid:          Vector of B flags, blocks not refined are set to the coarse maximum
+        num_peaks:      Number of coarse peaks refined in each block
+        resolution:     Target resolution [rad]
+        num_sources:    Number N of sources returned (N <= num_peaks)
+
+    Outputs:
+        azimuth:        B x N azimuth estimates [rad], NaN for missing peaks
+        elevation:      B x N elevation estimates [rad], NaN for missing peaks
+        evaluations:    Namespace with the number of grid points evaluated per block and
+                        the size of the full grid at the target resolution
+    """
+    nblocks = spectrum.shape[0]
+    # B x num_peaks candidates, strongest regional maxima of the coarse grid:
+    cand_az, cand_el, cand_power = find_doa_peaks(spectrum, az, el, num_peaks)
+
+    step_az = coarse_az = (az[-1] - az[0]) / max(az.shape[0] - 1, 1)
+    step_el = coarse_el = (el[-1] - el[0]) / max(el.shape[0] - 1, 1)
+    offsets = np.array([-1., 0., 1.])
+    evaluated = spectrum[0].size
+    while step_az > resolution or step_el > resolution:
+        step_az = step_az / 2 if step_az > resolution else step_az
+        step_el = step_el / 2 if step_el > resolution else step_el
+        # B x num_peaks x 9 local grids:
+        grid_az = cand_az[:, :, None, None] + step_az * offsets[:, None]
+        grid_el = np.clip(cand_el[:, :, None, None] + step_el * offsets[None, :], el[0], el[-1])
+        grid_az, grid_el = [np.broadcast_to(x, grid_az.shape[:2] + (3, 3)).reshape(nblocks, -1, 9)
+                            for x in [grid_az, grid_el]]
+        evaluated += grid_az.shape[1] * grid_az.shape[2]
+        for block_idx in np.flatnonzero(valid):
+            # Missing peaks (NaN) are not refined:
+            _idx = np.flatnonzero(np.isfinite(cand_power[block_idx]))
+            if _idx.shape[0] == 0:
+                continue
+            _az, _el = grid_az[block_idx, _idx].ravel(), grid_el[block_idx, _idx].ravel()
+            eta = sph2cart(np.stack([_az, _el]), axis=0)
+            SV = steering_vectors(eta[:, :, None], freq, rotation[block_idx], mics[block_idx],
+                                  ref_mic[block_idx], c)
+            power = pseudo_spectrum(Un[block_idx], SV).sum(0).reshape(_idx.shape[0], -1)
+            best = np.argmax(power, axis=1)
+            cand_az[block_idx, _idx] = grid_az[block_idx, _idx, best]
+            cand_el[block_idx, _idx] = grid_el[block_idx, _idx, best]
+            cand_power[block_idx, _idx] = power[np.arange(_idx.shape[0]), best]
+
+    # Candidates which converged within a coarse step of a stronger one are dropped:
+    order = np.argsort(-cand_power, axis=1, kind='stable')
+    cand_az, cand_el, cand_power = [np.take_along_axis(x, order, axis=1) for x in [cand_az, cand_el, cand_power]]
+    close = (np.abs(wrapToPi(cand_az[:, :, None] - cand_az[:, None, :])) < coarse_az) * \
+        (np.abs(cand_el[:, :, None] - cand_el[:, None, :]) < coarse_el)
+    duplicate = np.any(np.tril(close, k=-1), axis=2)
+    cand_power[duplicate] = -np.inf
+
+    # Strongest refined peaks:
+    best = np.argsort(-cand_power, axis=1, kind='stable')[:, :num_sources]
+    found = np.isfinite(np.take_along_axis(cand_power, best, axis=1))
+    azimuth = np.where(found, wrapToPi(np.take_along_axis(cand_az, best, axis=1)), np.nan)
+    elevation = np.where(found, np.take_along_axis(cand_el, best, axis=1), np.nan)
+
+    full_grid = (int(round((az[-1] - az[0]) / step_az)) + 1 if step_az > 0 else az.shape[0]) * \
+        (int(round((el[-1] - el[0]) / step_el)) + 1 if step_el > 0 else el.shape[0])
+    return azimuth, elevation, Namespace(evaluated=evaluated, full_grid=full_grid)
+
+
+def pseudo_spectrum(Un, SV):
+    """MUSIC pseudo-spectrum of a scan grid, [3] eq. (9.44)
+
+    Inputs:
+        Un:     F x M x K noise subspace of each frequency bin
+        SV:     F x M x A x E steering vectors of the scan grid
+
+    Outputs:
+        power:  F x A x E pseudo-spectrum, ||Un^H * SV||^2 <= M is floored at its precision
+                (eps * M) so the spectrum stays finite
+    """
+    if Un.shape[-1] == 0:
+        raise ValueError('The noise subspace is empty, see noise_subspace_dim')
+    # SV^H * Un * Un^H * SV = ||Un^H * SV||^2
+    proj = np.einsum('fmk,fmae->fkae', Un.conj(), SV)
+    norm = np.sum(proj.real ** 2 + proj.imag ** 2, axis=1)
+    return 1. / np.maximum(norm, np.finfo(norm.dtype).eps * SV.shape[1])
@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+# Copyright 2019 Waseda University (Nelson Yalta)
+# Apache 2.0  (http://www.apache.org/licenses/LICENSE-2.0)
+import logging
+import numpy as np
+
+from locata_wrapper.algorithm.music import MUSIC
+from locata_wrapper.algorithm.music import music_subspaces
+from locata_wrapper.algorithm.music import output_sources
+from locata_wrapper.utils.profiling import GetProfiler
+from locata_wrapper.utils.shared import wrapToPi
+
+
+def RootMUSIC(inputs, options, log=logging):
+    """RootMUSIC
+
+    implementation of root-MUSIC [1] for linear subarrays, with the same inputs and outputs as
+    locata_wrapper.algorithm.music.MUSIC. The direction of arrival is obtained by rooting the
+    MUSIC polynomial of each (block, frequency) pair, so no scan grid is evaluated.
+
+    The microphones of the subarray must lie on a line at integer multiples of a common spacing
+    (uniform or sparse linear array). A linear array only resolves the angle to its axis, so the
+    source is assumed in the horizontal plane of the array (elevation = pi/2) and in front of it:
+    of the two solutions mirrored by the array axis, the one closest to options.music.front_azimuth
+    is kept. A single source is estimated (the root closest to the unit circle). For other
+    geometries, the function falls back to the grid-scanned MUSIC.
+
+    Inputs:
+        see locata_wrapper.algorithm.music.MUSIC
+
+    Outputs:
+        see locata_wrapper.algorithm.music.MUSIC
+
+    References:
+        [1]    A. J. Barabell, Improving the resolution performance of eigenstructure-based
+               direction-finding algorithms. Proc. ICASSP, 1983.
+        [2]    H. L. Van Trees, Detection, Estimation, and Modulation Theory, Optimum Array Processing.
+               John Wiley & Sons, 2004.
+    """
+    profiler = GetProfiler(inputs, log)
+    if options.music.num_sources > 1:
+        log.warning('RootMUSIC estimates a single source, only the strongest of the {} sources is returned'.format(
+            options.music.num_sources))
+    # -> STFT, covariance and subspace stages
+    sub = music_subspaces(inputs, options, log)
+    nblocks = sub.block_timestamps.shape[0]
+    if not sub.valid_block.any():
+        log.warning('No valid block in the recording of {}'.format(inputs.array_name))
+        return output_sources(inputs, sub.block_timestamps, np.full([nblocks], np.nan), np.full([nblocks], np.nan))
+
+    # Microphone positions in the array coordinate system, relative to the reference mic
+    rotation = sub.rotation[:, sub.pose_idx].transpose(1, 0, 2)
+    mics = sub.mic[:, sub.pose_idx][:, :, sub.subarray]
+    local_mics = np.einsum('bji,jbm->bim', rotation, mics - mics[:, :, sub.ref_mic:sub.ref_mic + 1])
+    geometry = linear_geometry(np.median(local_mics[sub.valid_block], axis=0))
+    if geometry is None:
+        log.info('Subarray of {} is not linear, using grid-scanned MUSIC'.format(inputs.array_name))
+        return MUSIC(inputs, options, log)
+    lags, spacing, axis = geometry
+    if spacing > options.c / (2 * sub.freq.max()):
+        log.warning('Spacing of {} ({:.3f} m) produces spatial aliasing in the band'.format(
+            inputs.array_name, spacing))
+
+    # Noise subspace projector, [2] eq. (9.44): a^H * Un * Un^H * a
+    Un = sub.Un[sub.valid_block]
+    Pn = np.matmul(Un, Un.conj().swapaxes(-1, -2))
+
+    # Cosine of the angle between the DOA and the array axis for each (block, frequency)
+    with profiler.stage('peaks'):
+        z = polynomial_root(Pn, lags)
+    cos_theta = np.angle(z) * options.c / (2 * np.pi * sub.freq * spacing)
+    cos_theta[np.abs(cos_theta) > 1] = np.nan
+
+    azimuth = np.full([nblocks], np.nan)
+    elevation = np.full([nblocks], np.nan)
+    _valid = np.flatnonzero(sub.valid_block)
+    with np.errstate(all='ignore'):
+        # Broadband estimate, median over frequencies:
+        _cos = np.nanmedian(cos_theta, axis=1)
+
+    # Horizontal plane: eta = [-sin(az), cos(az), 0] and eta * axis = cos_theta
+    norm = np.hypot(axis[0], axis[1])
+    phi = np.arctan2(-axis[0], axis[1])
+    delta = np.arccos(np.clip(_cos / max(norm, np.finfo(float).eps), -1, 1))
+    candidates = wrapToPi(np.stack([phi + delta, phi - delta], axis=1))
+    best = np.argmin(np.abs(wrapToPi(candidates - np.radians(options.music.front_azimuth))), axis=1)
+    azimuth[_valid] = candidates[np.arange(_valid.shape[0]), best]
+    elevation[_valid] = np.where(np.isnan(_cos), np.nan, np.pi / 2)
+
+    with profiler.stage('interpolation'):
+        return output_sources(inputs, sub.block_timestamps, azimuth, elevation)
+
+
+def linear_geometry(positions, tol=0.05):
+    """Check that microphones form a (sparse) linear array
+
+    Inputs:
+        positions:  3 x M microphone positions
+        tol:        Tolerance relative to the spacing
+
+    Outputs:
+        None if the array is not linear, otherwise
+        lags:       Vector of M integer positions along the array axis
+        spacing:    Spacing of the array [m]
+        axis:       Unit vector of the array axis
+    """
+    centered = positions - positions.mean(axis=1, keepdims=True)
+    _u, _s, _ = np.linalg.svd(centered)
+    axis = _u[:, 0]
+    coord = np.dot(axis, positions)
+    dist = np.sort(np.abs(coord[:, None] - coord[None, :])[np.triu_indices(coord.shape[0], 1)])
+    dist = dist[dist > 0]
+    if dist.shape[0] == 0:
+        return None
+    spacing = dist[0]
+    off_axis = np.linalg.norm(centered - np.outer(axis, np.dot(axis, centered)), axis=0)
+    lags = np.round((coord - coord.min()) / spacing)
+    if off_axis.max() > tol * spacing or np.abs(coord - coord.min() - lags * spacing).max() > tol * spacing:
+        return None
+    # Refine the spacing with all the microphones:
+    spacing = np.dot(lags, coord - coord.min()) / np.dot(lags, lags)
+    return lags.astype(int), spacing, axis
+
+
+def polynomial_root(Pn, lags):
+    """Root of the MUSIC polynomial closest to the unit circle
+
+    For a linear array with steering vector a(z) = z^lags, a(z)^H * Pn * a(z) is the
+    polynomial sum_l c_l z^l with c_l the sum of the entries of Pn with lags[m] - lags[n] = l.
+    Its roots are found as eigenvalues of the companion matrices, batched over all the
+    (block, frequency) pairs.
+
+    Inputs:
+        Pn:     ... x M x M noise subspace projectors
+        lags:   Vector of M integer positions of the microphones
+
+    Outputs:
+        z:      ... roots inside the unit circle closest to it
+    """
+    max_lag = lags.max() - lags.min()
+    diff = lags[None, :] - lags[:, None]
+    # Coefficients of z^(2 max_lag) ... z^0:
+    coef = np.stack([Pn[..., diff == lag].sum(-1) for lag in range(max_lag, -max_lag - 1, -1)], axis=-1)
+    degree = coef.shape[-1] - 1
+    companion = np.zeros(coef.shape[:-1] + (degree, degree), dtype=coef.dtype)
+    companion[..., 0, :] = -coef[..., 1:] / coef[..., :1]
+    companion[..., np.arange(1, degree), np.arange(degree - 1)] = 1
+    roots = np.linalg.eigvals(companion)
+    # Roots come in pairs (z, 1 / z^*), keep the one inside the unit circle closest to it:
+    _abs = np.abs(roots)
+    _abs[_abs > 1 + 1e-9] = -np.inf
+    return np.take_along_axis(roots, np.argmax(_abs, axis=-1)[..., None], axis=-1)[..., 0]
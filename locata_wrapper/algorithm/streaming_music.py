@@ -0,0 +1,234 @@
+# -*- coding: utf-8 -*-
+# Copyright 2019 Waseda University (Nelson Yalta)
+# Apache 2.0  (http://www.apache.org/licenses/LICENSE-2.0)
+import logging
+import numpy as np
+from scipy.signal import get_window
+
+from locata_wrapper.algorithm.music import band_bins
+from locata_wrapper.algorithm.music import find_doa_peaks
+from locata_wrapper.algorithm.music import hierarchical_search
+from locata_wrapper.algorithm.music import music_subarray
+from locata_wrapper.algorithm.music import noise_subspace
+from locata_wrapper.algorithm.music import noise_subspace_dim
+from locata_wrapper.algorithm.music import pseudo_spectrum
+from locata_wrapper.algorithm.music import SLIDING_RESET
+from locata_wrapper.utils.steering import steering_cache
+from locata_wrapper.utils.stft import dft
+from locata_wrapper.utils.stft import fft_frequencies
+from locata_wrapper.utils.stft import frame_signal
+from locata_wrapper.utils.stft import samples_to_time
+
+
+class StreamingMUSIC(object):
+    """StreamingMUSIC
+
+    Online version of locata_wrapper.algorithm.music.MUSIC. Audio is pushed in chunks of
+    any length and the DOA of a block is estimated as soon as its last STFT frame is
+    available. Only the frames of the current block (ring buffer) and its running
+    covariance are kept, so the memory does not grow with the length of the recording.
+
+    The framing, the blocks and the estimates are those of MUSIC for the same settings
+    (the block estimates are not interpolated to the OptiTrack timestamps). The last
+    blocks, which depend on the length of the recording, are returned by flush().
+
+    Arguments:
+        array_name: String containing array name: 'eigenmike', 'dicit', 'dummy', 'benchmark2'
+        fs:         Sampling frequency [Hz]
+        rotation:   3 x 3 rotation matrix describing the array orientation
+        mics:       3 x M matrix of the microphone positions of the array
+        options:    Settings structure generated by init(), options.music contains the MUSIC settings
+    """
+
+    def __init__(self, array_name, fs, rotation, mics, options, log=logging):
+        music_opts = options.music
+        self.array_name = array_name
+        self.fs = fs
+        self.c = options.c
+        self.opts = music_opts
+        self.log = log
+        self.subarray = music_subarray(array_name, mics.shape[1], music_opts, log)
+        self.set_pose(rotation, mics)
+
+        self.az = np.linspace(*np.radians(music_opts.azimuth_range), music_opts.num_azimuth)
+        self.el = np.linspace(*np.radians(music_opts.elevation_range), music_opts.num_elevation)
+        num_mics = self.subarray.shape[0]
+        self.noise_dim = noise_subspace_dim(num_mics, music_opts)
+
+        self.n_fft = music_opts.fft_point
+        self.hop_length = int(music_opts.frame_duration * fs) // music_opts.hops_per_frame
+        self.window = get_window('hamming', self.n_fft, fftbins=True)
+        self.freq_idx = band_bins(fs, music_opts)
+        self.freq = fft_frequencies(fs, self.n_fft)[self.freq_idx]
+
+        self.frames_per_block = music_opts.frames_per_block
+        self.block_step = music_opts.block_step
+        self.reset_every = SLIDING_RESET
+        # Ring buffer with the STFT frames of the current block and their running covariance:
+        self._ring = np.zeros([self.frames_per_block, self.freq.shape[0], num_mics], dtype=np.complex128)
+        self._R = np.zeros([self.freq.shape[0], num_mics, num_mics], dtype=np.complex128)
+        self.reset()
+
+    def reset(self):
+        """Start a new stream"""
+        self.num_samples = 0   # Samples pushed
+        self.num_frames = 0    # STFT frames computed
+        self.num_blocks = 0    # Blocks estimated
+        self._buffer = np.zeros([0, self.subarray.shape[0]])
+        self._buffer_start = 0  # Index of the first buffered sample in the (reflect) padded signal
+        self._started = False
+        self._R[:] = 0
+
+    def set_pose(self, rotation, mics):
+        """Update the array pose used for the next blocks
+
+        Inputs:
+            rotation:   3 x 3 rotation matrix describing the array orientation
+            mics:       3 x M matrix of the microphone positions of the array
+        """
+        self.rotation = np.asarray(rotation)
+        self.mics = np.asarray(mics)
+
+    def push(self, samples):
+        """Push audio samples
+
+        Inputs:
+            samples:    N x M matrix of samples of all the channels of the array
+
+        Outputs:
+            estimates:  List of (block_timestamp, azimuth, elevation) of the blocks completed,
+                        azimuth and elevation are vectors with one estimate per source [rad]
+        """
+        samples = np.asarray(samples)[:, self.subarray]
+        self.num_samples += samples.shape[0]
+        self._buffer = np.concatenate([self._buffer, samples], axis=0)
+        pad = self.n_fft // 2
+        if not self._started:
+            if self._buffer.shape[0] <= pad:
+                return []
+            # Reflect padding of the beginning of the signal (centered frames):
+            self._buffer = np.concatenate([self._buffer[pad:0:-1], self._buffer], axis=0)
+            self._started = True
+        # The frames following nframe - 2 are not used by MUSIC, see flush():
+        return self._process(self._num_frames(self.num_samples) - 1)
+
+    def flush(self):
+        """End the stream
+
+        Outputs:
+            estimates:  List of (block_timestamp, azimuth, elevation) of the remaining blocks,
+                        including the last blocks with less than frames_per_block frames
+        """
+        pad = self.n_fft // 2
+        if not self._started:
+            raise ValueError('At least {} samples are required, {} were pushed'.format(pad + 1, self.num_samples))
+        # Reflect padding of the end of the signal:
+        self._buffer = np.concatenate([self._buffer, self._buffer[-2:-pad - 2:-1]], axis=0)
+        nframe = self._num_frames(self.num_samples)
+        estimates = self._process(nframe - 1)
+
+        # Blocks ending after the last frame are truncated to frame nframe - 1:
+        while self.num_blocks * self.block_step < nframe - 1:
+            srt = self.num_blocks * self.block_step
+            estimates.append(self._estimate(srt, nframe - 1))
+            self._advance(srt, nframe - 1)
+        self.reset()
+        return estimates
+
+    def _num_frames(self, num_samples):
+        # Number of frame timestamps of MUSIC, samples 0, hop_length, ... < num_samples
+        return -(-num_samples // self.hop_length)
+
+    def _process(self, max_frames):
+        """Compute the available STFT frames (up to max_frames) and estimate the completed blocks"""
+        hop = self.hop_length
+        avail = (self._buffer_start + self._buffer.shape[0] - self.n_fft) // hop + 1
+        avail = min(avail, max_frames)
+        estimates = []
+        if avail <= self.num_frames:
+            return estimates
+
+        # STFT of the new frames, band-limited bins only:
+        frames = frame_signal(self._buffer[self.num_frames * hop - self._buffer_start:], self.n_fft, hop)
+        X = self._dft(frames[:avail - self.num_frames])
+
+        for frame_idx, data in zip(range(self.num_frames, avail), X):
+            srt = self.num_blocks * self.block_step
+            if frame_idx >= srt:
+                self._ring[frame_idx % self.frames_per_block] = data
+                self._R += data[:, :, None] * data[:, None, :].conj()
+            self.num_frames = frame_idx + 1
+            if frame_idx + 1 == srt + self.frames_per_block:
+                estimates.append(self._estimate(srt, srt + self.frames_per_block))
+                self._advance(srt, srt + self.frames_per_block)
+
+        # Keep the samples of the next frames and the end of the signal for the reflect padding:
+        keep = min(self.num_frames * hop, self._buffer_start + self._buffer.shape[0] - self.n_fft // 2 - 1)
+        self._buffer = self._buffer[keep - self._buffer_start:]
+        self._buffer_start = keep
+        return estimates
+
+    def _dft(self, frames):
+        if self.opts.band_dft:
+            return dft(frames, self.window, self.freq_idx, self.opts.stft_dtype)
+        return dft(frames, self.window, dtype=self.opts.stft_dtype)[:, self.freq_idx]
+
+    def _advance(self, srt, end):
+        """Move the running covariance from the block (srt, end) to the next one"""
+        self.num_blocks += 1
+        new_srt = self.num_blocks * self.block_step
+        if new_srt >= end:
+            self._R[:] = 0
+        elif self.num_blocks % self.reset_every == 0:
+            data = self._ring[np.arange(new_srt, end) % self.frames_per_block]
+            self._R = np.einsum('tfm,tfn->fmn', data, data.conj())
+        else:
+            data = self._ring[np.arange(srt, new_srt) % self.frames_per_block]
+            self._R -= np.einsum('tfm,tfn->fmn', data, data.conj())
+
+    def _estimate(self, srt, end):
+        """DOA estimates of the block of frames (srt, end), end excluded"""
+        frame_time = samples_to_time(np.array([srt, end]) * self.hop_length, self.fs)
+        block_timestamp = np.mean(frame_time)
+        nsrc = self.opts.num_sources
+        if end - srt <= 1:
+            # Not enough frames for a noise subspace, as MUSIC the spectrum is flat:
+            azimuth, elevation, _ = find_doa_peaks(np.zeros([1, self.az.shape[0], self.el.shape[0]]),
+                                                   self.az, self.el, nsrc)
+            return block_timestamp, azimuth[0], elevation[0]
+
+        Un = noise_subspace(self._R.astype(self.opts.dtype), self.noise_dim)
+        SV = steering_cache.get(self.array_name, self.subarray, self.opts.ref_mic, self.rotation,
+                                self.mics, self.az, self.el, self.freq, self.c)
+        spectrum = pseudo_spectrum(Un, SV).sum(0)[None]
+        if self.opts.search == 'hierarchical':
+            mics = self.mics[:, self.subarray]
+            azimuth, elevation, _ = hierarchical_search(
+                spectrum, self.az, self.el, Un[None], self.freq, self.rotation[None], mics[None],
+                mics[:, self.opts.ref_mic][None], self.c, np.ones([1], dtype=bool),
+                max(self.opts.refine_peaks, nsrc), np.radians(self.opts.target_resolution), nsrc)
+        else:
+            azimuth, elevation, _ = find_doa_peaks(spectrum, self.az, self.el, nsrc)
+        return block_timestamp, azimuth[0], elevation[0]
+
+
+def stream_music(chunks, array_name, fs, rotation, mics, options, log=logging):
+    """Generator of the DOA estimates of a stream of audio chunks
+
+    Inputs:
+        chunks:         Iterable of N x M matrices of samples
+        array_name:     String containing array name
+        fs:             Sampling frequency [Hz]
+        rotation:       3 x 3 rotation matrix describing the array orientation
+        mics:           3 x M matrix of the microphone positions of the array
+        options:        Settings structure generated by init()
+
+    Outputs:
+        Yields (block_timestamp, azimuth, elevation) for each block, as soon as it is completed
+    """
+    music = StreamingMUSIC(array_name, fs, rotation, mics, options, log)
+    for samples in chunks:
+        for estimate in music.push(samples):
+            yield estimate
+    for estimate in music.flush():
+        yield estimate
@@ -3,7 +3,6 @@
 # Copyright 2019 Waseda University (Nelson Yalta)
 # Apache 2.0  (http://www.apache.org/licenses/LICENSE-2.0)
 
-from argparse import Namespace
 import locata_wrapper.utils as locata_utils
 import logging
 
@@ -40,6 +39,26 @@ def config_eval():
                  LOCATA List [1,2,3,4,5,6] is taken as default which evaluates
                  over all available tasks
                  DCASE list [1 2 3 4]
+    algorithm:   Import path 'module_name:function_name' of the localization
+                 algorithm or one of the shortcuts {'music', 'root_music'}
+    processes:   Number of processes, the (task, recording, array) work items are
+                 run in parallel
+    cache_dir:   String with directory path of the cache of the decoded recordings
+                 (optional), None disables the cache
+    music:       Dictionary with the settings of MUSIC (optional), see
+                 locata_wrapper.utils.opts.MUSICOptions for the available keys
+    plots:       Figures of the estimates {'off', 'inline', 'deferred'}
+                 off: no figures (matplotlib is not imported)
+                 inline: saved after the localization of each work item
+                 deferred: saved from the results files once all the work items
+                 are processed, on args.processes processes
+    profile:     Profile of the stages of each work item {'off', 'time', 'memory'}
+                 time: time of each stage saved to profile.json / profile.csv next to
+                 the results and aggregated in results_dir/profile_summary.csv
+                 memory: as time, with the peak memory of each stage (tracemalloc, slower)
+    resume:      Skip the work items whose results are current according to the
+                 manifest of results_dir (same input files, algorithm source and
+                 options), False processes all the work items
 
     Outputs: N/A (saves results as csv files in save_dir)
     """
@@ -51,26 +70,23 @@ def config_eval():
     tasks = [1, 2, 3, 4, 5, 6]  # NOQA
     algorithm = 'locata_wrapper.algorithm.music:MUSIC'  # NOQA
     processes = 1  # NOQA
+    cache_dir = None  # NOQA
+    music = locata_utils.MUSICOptions().to_dict()  # NOQA
+    plots = 'deferred'  # NOQA
+    profile = 'off'  # NOQA
+    resume = True  # NOQA
 
 
 @ex.main
 def main_eval(_config, _log):
-    # Straight copy or use of prt for _config generates error due to ReadOnlyList/Dict
-    # to avoid problems for multiprocessing each value is copy and in for ReadOnlyList
-    # these are converter to lists
-    args = Namespace()
-    for _value in [x for x in _config if '__' not in x]:
-        if 'List' in str(type(_config[_value])):
-            setattr(args, _value, list(_config[_value]))
-        else:
-            setattr(args, _value, _config[_value])
+    args = locata_utils.ConfigArgs(_config)
 
     # Selection of the localisation algorithm
 
     # Enter the name of the PYTHON function of your localization algorithm.
     # The LOCATA organizers provided MUSIC here as an example for the required interface.
     # Check the documentation inside for contents of structures.
-    my_alg_name = locata_utils.DynamicImport(args.algorithm, log=_log)
+    my_alg_name = locata_utils.DynamicImport(args.algorithm, alias=locata_utils.ALGORITHMS, log=_log)
 
     # Check and process input arguments
 
@@ -85,6 +101,18 @@ def main_eval(_config, _log):
 
     # Initialize settings required for these scripts:
     opts = locata_utils.InitalOptions()
+    try:
+        opts.music = locata_utils.MUSICOptions(**args.music)
+    except (TypeError, ValueError) as e:
+        _log.error('Invalid MUSIC settings: {}'.format(e))
+        sys.exit(1)
+
+    if args.plots not in locata_utils.PLOT_MODES:
+        _log.error('Invalid plotting mode {}, expected one of {}'.format(args.plots, locata_utils.PLOT_MODES))
+        sys.exit(1)
+    if args.profile not in locata_utils.PROFILE_MODES:
+        _log.error('Invalid profiling mode {}, expected one of {}'.format(args.profile, locata_utils.PROFILE_MODES))
+        sys.exit(1)
 
     # Check and process input arguments
     # check if input contains valid tasks
@@ -107,22 +135,31 @@ def main_eval(_config, _log):
         args.data_dir, args.tasks))
 
     # Process
-    # Parse through all specified task folders
-    task_process = locata_utils.ProcessTask
-
-    # Multiprocessing
-    if args.processes > 1:
-        from pathos.multiprocessing import ProcessingPool
-        pool = ProcessingPool(args.processes)
-
-    for this_task in args.tasks:
-        if args.processes > 1:
-            pool.map(task_process, [this_task], [my_alg_name], [opts], [args], [_log])
-        else:
-            task_process(this_task, my_alg_name, opts, args, _log)
-    if args.processes > 1:
-        pool.close()
-        pool.join()
+    # Enumerate the (task, recording, array) work items of all the specified task folders,
+    # longest recordings first, and process them on args.processes processes
+    # Work items with current results in the manifest are skipped, the manifest is
+    # updated as soon as each work item is completed:
+    items = locata_utils.ListWorkItems(args, log=_log)
+    manifest = locata_utils.LoadManifest(args.results_dir, _log)
+    fingerprint = locata_utils.RunFingerprint(my_alg_name, opts, args)
+    items, done = locata_utils.PendingWorkItems(items, manifest, fingerprint, args, _log)
+    keys = {locata_utils.ManifestKey(x): x for x in items}
+    summaries = list()
+    for idx, summary in enumerate(locata_utils.RunWorkItems(items, my_alg_name, opts, args, _log)):
+        _log.info('[{}/{}] Finished task {}, recording {}, array {} ({:.2f} s)'.format(
+            idx + 1, len(items), summary.task, summary.recording_id, summary.array_name, summary.telapsed))
+        summaries.append(summary)
+        key = locata_utils.ManifestKey(summary)
+        entry = locata_utils.ManifestEntry(keys[key], fingerprint, summary, args.results_dir)
+        locata_utils.RemoveStaleOutputs(manifest.get(key), entry, args.results_dir, _log)
+        manifest[key] = entry
+        locata_utils.SaveManifest(args.results_dir, manifest)
+    if args.profile != 'off':
+        locata_utils.SaveProfiles(summaries, args.results_dir, _log)
+    # Figures of the processed work items (deferred) and of the skipped ones without figures:
+    plot_items = (items if args.plots == 'deferred' else []) + locata_utils.MissingPlots(done, args)
+    if args.plots != 'off' and len(plot_items) > 0:
+        locata_utils.PlotWorkItems(plot_items, args, _log)
     _log.info('Processing finished!')
 
 
@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright 2019 Waseda University (Nelson Yalta)
+# Apache 2.0  (http://www.apache.org/licenses/LICENSE-2.0)
+
+import locata_wrapper.utils as locata_utils
+import logging
+
+import os
+from sacred import Experiment
+
+import sys
+
+
+ex = Experiment()
+logging.basicConfig(format='%(asctime)s (%(module)s:%(lineno)d) %(levelname)s: %(message)s')
+logger = logging.getLogger('my_custom_logger')
+ex.logger = logger
+
+
+@ex.config
+def config_score():
+    """Inputs:
+
+    data_dir:    String with directory path for the LOCATA Dev database
+    results_dir: String with directory path of the results of eval_loc.py
+    is_dev:      Kind of database specified by data_dir, only the Dev database
+                 (True) has ground truth for the sources
+    arrays:      List with array names which should be scored (optional)
+                 LOCATA list {'benchmark2', 'eigenmike', 'dicit','dummy'} is taken
+                 as default which contains all available arrays
+    tasks:       List with task(s) (optional)
+                 LOCATA List [1,2,3,4,5,6] is taken as default
+    processes:   Number of processes, the (task, recording, array) work items are
+                 scored in parallel
+    cache_dir:   String with directory path of the cache of the decoded recordings
+                 (optional), None disables the cache
+
+    Outputs: N/A (saves one table per task and array, results_dir/task<N>/scores_<array>.txt)
+    """
+    data_dir = './data'  # NOQA
+    results_dir = './results'  # NOQA
+    is_dev = True  # NOQA
+    arrays = ['benchmark2', 'eigenmike', 'dicit', 'dummy']  # NOQA
+    tasks = [1, 2, 3, 4, 5, 6]  # NOQA
+    processes = 1  # NOQA
+    cache_dir = None  # NOQA
+    # Settings of eval_loc.py, not used for scoring (the same config file can be used):
+    algorithm = None  # NOQA
+    music = locata_utils.MUSICOptions().to_dict()  # NOQA
+    plots = 'off'  # NOQA
+    profile = 'off'  # NOQA
+    resume = True  # NOQA
+
+
+@ex.main
+def main_score(_config, _log):
+    args = locata_utils.ConfigArgs(_config)
+    # Ground truth is only available for the development database:
+    if not args.is_dev:
+        _log.error('Results can only be scored on the Dev database')
+        sys.exit(1)
+
+    if not os.path.exists(args.data_dir):
+        _log.error('Incorrect data path!')
+        sys.exit(1)
+    if not os.path.exists(args.results_dir):
+        _log.error('Incorrect results path!')
+        sys.exit(1)
+
+    items = locata_utils.ListWorkItems(args, log=_log)
+    scores = list()
+    for idx, item_scores in enumerate(locata_utils.RunScoreItems(items, args, _log)):
+        scores += item_scores
+        _log.debug('[{}/{}] Scored work item'.format(idx + 1, len(items)))
+    locata_utils.SaveScores(scores, args.results_dir, _log)
+    _log.info('Scoring finished!')
+
+
+if __name__ == '__main__':
+    ex.run_commandline()
@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright 2019 Waseda University (Nelson Yalta)
+# Apache 2.0  (http://www.apache.org/licenses/LICENSE-2.0)
+
+from collections import OrderedDict
+import locata_wrapper.utils as locata_utils
+import locata_wrapper.utils.sweep as locata_sweep
+import logging
+
+import os
+from sacred import Experiment
+
+import sys
+
+
+ex = Experiment()
+logging.basicConfig(format='%(asctime)s (%(module)s:%(lineno)d) %(levelname)s: %(message)s')
+logger = logging.getLogger('my_custom_logger')
+ex.logger = logger
+
+
+@ex.config
+def config_sweep():
+    """Inputs:
+
+    data_dir:    String with directory path for the LOCATA/DCASE Dev or Eval database
+    results_dir: String with directory path in which to save the results of every
+                 configuration (results_dir/config<N>) and the comparison table
+    is_dev:      Kind of database specified by data_dir, the configurations are only
+                 scored on the Dev database (True)
+    arrays:      List with array names which should be evaluated (optional)
+    tasks:       List with task(s) (optional)
+    algorithm:   Import path 'module_name:function_name' of the localization
+                 algorithm or one of the shortcuts {'music', 'root_music'}
+    processes:   Number of processes, the (task, recording, array) work items are
+                 run in parallel
+    cache_dir:   String with directory path of the cache of the decoded recordings
+                 (optional), None disables the cache
+    music:       Dictionary with the base settings of MUSIC, see
+                 locata_wrapper.utils.opts.MUSICOptions for the available keys
+    sweep:       List of MUSIC settings {name: list of values}, every combination
+                 of values is evaluated, e.g. [{'freq_band': [[500, 1400], [800, 1400]]},
+                 {'num_azimuth': [37, 73]}] (a list, as sacred does not accept new
+                 keys in dictionaries), an empty list runs the base settings only
+
+    Outputs: N/A (saves results as csv files in results_dir/config<N> and the
+             comparison of the configurations in results_dir/comparison.csv)
+    """
+    data_dir = './data'  # NOQA
+    results_dir = './results'  # NOQA
+    is_dev = True  # NOQA
+    arrays = ['benchmark2', 'eigenmike', 'dicit', 'dummy']  # NOQA
+    tasks = [1, 2, 3, 4, 5, 6]  # NOQA
+    algorithm = 'locata_wrapper.algorithm.music:MUSIC'  # NOQA
+    processes = 1  # NOQA
+    cache_dir = None  # NOQA
+    music = locata_utils.MUSICOptions().to_dict()  # NOQA
+    sweep = list()  # NOQA
+    # Settings of eval_loc.py, not used by the sweep (the same config file can be used):
+    plots = 'off'  # NOQA
+    profile = 'off'  # NOQA
+    resume = True  # NOQA
+
+
+@ex.main
+def main_sweep(_config, _log):
+    args = locata_utils.ConfigArgs(_config)
+
+    my_alg_name = locata_utils.DynamicImport(args.algorithm, alias=locata_utils.ALGORITHMS, log=_log)
+
+    if not os.path.exists(args.data_dir):
+        _log.error('Incorrect data path!')
+        sys.exit(1)
+    os.makedirs(args.results_dir, exist_ok=True)
+
+    opts = locata_utils.InitalOptions()
+    grid = OrderedDict()
+    for x in args.sweep:
+        grid.update(x)
+    try:
+        configs = locata_sweep.SweepConfigs(args.music, grid)
+    except (TypeError, ValueError) as e:
+        _log.error('Invalid MUSIC settings in the sweep: {}'.format(e))
+        sys.exit(1)
+    _log.info('Sweeping {} configurations'.format(len(configs)))
+    if args.arrays is None:
+        args.arrays = opts.valid_arrays
+
+    items = locata_utils.ListWorkItems(args, log=_log)
+    summaries = list()
+    for idx, summary in enumerate(locata_sweep.RunSweepItems(items, my_alg_name, opts, configs, args, _log)):
+        _log.info('[{}/{}] Finished task {}, recording {}, array {} ({} configurations, {} STFTs)'.format(
+            idx + 1, len(items), summary.task, summary.recording_id, summary.array_name, len(summary.rows),
+            summary.frontends))
+        summaries.append(summary)
+    locata_sweep.SaveComparison(summaries, configs, args.results_dir, _log)
+    _log.info('Sweep finished!')
+
+
+if __name__ == '__main__':
+    ex.run_commandline()
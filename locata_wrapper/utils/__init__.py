@@ -1,3 +1,27 @@
+from locata_wrapper.utils.config import ALGORITHMS  # NOQA
+from locata_wrapper.utils.config import ConfigArgs  # NOQA
 from locata_wrapper.utils.dynamic_import import DynamicImport  # NOQA
+from locata_wrapper.utils.manifest import LoadManifest  # NOQA
+from locata_wrapper.utils.manifest import ManifestEntry  # NOQA
+from locata_wrapper.utils.manifest import ManifestKey  # NOQA
+from locata_wrapper.utils.manifest import PendingWorkItems  # NOQA
+from locata_wrapper.utils.manifest import RemoveStaleOutputs  # NOQA
+from locata_wrapper.utils.manifest import RunFingerprint  # NOQA
+from locata_wrapper.utils.manifest import SaveManifest  # NOQA
 from locata_wrapper.utils.opts import InitalOptions  # NOQA
+from locata_wrapper.utils.opts import MUSICOptions  # NOQA
+from locata_wrapper.utils.plot import MissingPlots  # NOQA
+from locata_wrapper.utils.plot import PLOT_MODES  # NOQA
+from locata_wrapper.utils.plot import PlotWorkItems  # NOQA
+from locata_wrapper.utils.profiling import PROFILE_MODES  # NOQA
+from locata_wrapper.utils.profiling import Profiler  # NOQA
+from locata_wrapper.utils.profiling import SaveProfiles  # NOQA
+from locata_wrapper.utils.process import ListWorkItems  # NOQA
+from locata_wrapper.utils.process import ProcessArray  # NOQA
 from locata_wrapper.utils.process import ProcessTask  # NOQA
+from locata_wrapper.utils.process import RunWorkItems  # NOQA
+from locata_wrapper.utils.score import RunScoreItems  # NOQA
+from locata_wrapper.utils.score import SaveScores  # NOQA
+from locata_wrapper.utils.score import ScoreArray  # NOQA
+# locata_wrapper.utils.sweep uses locata_wrapper.algorithm.music, which imports this package,
+# so it is not imported here (see locata_wrapper/bin/sweep_loc.py)
@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+# Copyright 2019 Waseda University (Nelson Yalta)
+# Apache 2.0  (http://www.apache.org/licenses/LICENSE-2.0)
+
+import numpy as np
+import soundfile
+
+
+class LazyAudio(object):
+    """LazyAudio
+
+    Handle of a multichannel audio file which is decoded on access. Only the requested
+    channels and time range are kept in memory, the file is read by chunks of frames.
+    Indexing (e.g. y[:, subarray] or y[start:stop]) and numpy conversions read the file,
+    so the handle can be used in place of the N x M signal matrix.
+
+    Arguments:
+        fname:      Path of the audio file
+        dtype:      Default dtype of the decoded samples
+        chunk_size: Number of frames decoded at once
+    """
+
+    def __init__(self, fname, dtype='float64', chunk_size=2 ** 16):
+        self.fname = fname
+        self.dtype = np.dtype(dtype)
+        self.chunk_size = chunk_size
+        info = soundfile.info(fname)
+        self.fs = info.samplerate
+        self.shape = (info.frames, info.channels)
+
+    @property
+    def ndim(self):
+        return 2
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __repr__(self):
+        return 'LazyAudio({}, shape={}, fs={})'.format(self.fname, self.shape, self.fs)
+
+    def read(self, channels=None, start=0, stop=None, dtype=None):
+        """Decode a part of the file
+
+        Inputs:
+            channels:   Indexes (or slice) of the channels (None: all the channels)
+            start:      First frame
+            stop:       End frame, excluded (None: end of the file)
+            dtype:      dtype of the samples (None: default dtype of the handle)
+
+        Outputs:
+            y:          (stop - start) x len(channels) signal
+        """
+        dtype = self.dtype if dtype is None else np.dtype(dtype)
+        start, stop, _ = slice(start, stop).indices(self.shape[0])
+        stop = max(start, stop)
+        channels = np.arange(self.shape[1])[slice(None) if channels is None else channels]
+        all_channels = np.array_equal(channels, np.arange(self.shape[1]))
+        y = np.empty((stop - start,) + channels.shape, dtype=dtype)
+        # soundfile decodes to float32 or float64, other dtypes are converted:
+        read_dtype = dtype.name if dtype.name in ['float32', 'float64'] else 'float64'
+        with soundfile.SoundFile(self.fname) as f:
+            f.seek(start)
+            for srt in range(start, stop, self.chunk_size):
+                data = f.read(min(self.chunk_size, stop - srt), dtype=read_dtype, always_2d=True)
+                y[srt - start:srt - start + data.shape[0]] = data if all_channels else data[:, channels]
+        return y
+
+    def __getitem__(self, key):
+        if not isinstance(key, tuple):
+            key = (key,)
+        rows = key[0] if len(key) > 0 else slice(None)
+        cols = key[1] if len(key) > 1 else slice(None)
+        if isinstance(rows, slice) and rows.step in [None, 1] and len(key) <= 2:
+            y = self.read(cols, rows.start, rows.stop)
+            return y if np.ndim(cols) > 0 or isinstance(cols, slice) else y.reshape(-1)
+        return np.asarray(self)[key]
+
+    def __array__(self, dtype=None, copy=None):
+        return self.read(dtype=dtype)
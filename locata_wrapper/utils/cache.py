@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+# Copyright 2019 Waseda University (Nelson Yalta)
+# Apache 2.0  (http://www.apache.org/licenses/LICENSE-2.0)
+
+from argparse import Namespace
+import glob
+import json
+import logging
+import numpy as np
+import os
+import pandas as pd
+
+from locata_wrapper.utils.audio import LazyAudio
+
+# Version of the cache layout, caches of other versions are rebuilt
+CACHE_VERSION = 1
+
+
+def SourceManifest(array_dir):
+    """SourceManifest
+
+    Inputs:
+        array_dir:  Directory of a recording / array of the LOCATA database
+
+    Outputs:
+        manifest:   Dictionary file name: [mtime (ns), size (bytes)] of the wav and txt files
+    """
+    manifest = dict()
+    for fname in sorted(glob.glob(os.path.join(array_dir, '*.wav')) + glob.glob(os.path.join(array_dir, '*.txt'))):
+        stat = os.stat(fname)
+        manifest[os.path.basename(fname)] = [stat.st_mtime_ns, stat.st_size]
+    return manifest
+
+
+def CachePath(array_dir, args):
+    """Directory of the cache of a recording / array, mirroring the database tree in args.cache_dir"""
+    rel_dir = os.path.relpath(os.path.abspath(array_dir), os.path.abspath(args.data_dir))
+    return os.path.join(args.cache_dir, rel_dir)
+
+
+def LoadCache(cache_dir, array_dir, is_dev=True, log=logging):
+    """LoadCache
+
+    Inputs:
+        cache_dir:  Directory of the cache of a recording / array
+        array_dir:  Directory of the recording / array in the database
+        is_dev:     Kind of database, the cache of the other kind is not used
+
+    Outputs:
+        None if the cache is missing or outdated (a source file changed), otherwise the
+        outputs of LoadData, with the arrays memory-mapped (read-only) from the cache
+    """
+    layout_fname = os.path.join(cache_dir, 'layout.json')
+    if not os.path.exists(layout_fname):
+        return None
+    with open(layout_fname) as f:
+        layout = json.load(f)
+    if layout.get('version') != CACHE_VERSION or layout.get('is_dev') != bool(is_dev) or \
+            layout.get('sources') != SourceManifest(array_dir):
+        log.info('Cache of {} is outdated'.format(array_dir))
+        return None
+    return tuple(_load(x, cache_dir) for x in layout['outputs'])
+
+
+def SaveCache(cache_dir, array_dir, outputs, is_dev=True):
+    """SaveCache
+
+    stores the outputs of LoadData as .npy files. Audio is stored in float32 (exact
+    for 16 bit recordings), datetimes as int64 nanoseconds. The layout (written last) keeps the
+    structure of the outputs and the mtime / size of the source files.
+
+    Inputs:
+        cache_dir:  Directory of the cache of a recording / array
+        array_dir:  Directory of the recording / array in the database
+        outputs:    Outputs of LoadData
+        is_dev:     Kind of database
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    sources = SourceManifest(array_dir)
+    layout = dict(version=CACHE_VERSION, is_dev=bool(is_dev), sources=sources,
+                  outputs=[_save(x, cache_dir, 'output{}'.format(i)) for i, x in enumerate(outputs)])
+    tmp_fname = os.path.join(cache_dir, 'layout.json.tmp')
+    with open(tmp_fname, 'w') as f:
+        json.dump(layout, f, indent=1)
+    os.replace(tmp_fname, os.path.join(cache_dir, 'layout.json'))
+
+
+def _save(value, cache_dir, key, field=None):
+    if isinstance(value, Namespace):
+        return dict(type='namespace', fields={k: _save(v, cache_dir, '{}.{}'.format(key, k), k)
+                                              for k, v in value.__dict__.items()})
+    if isinstance(value, dict):
+        return dict(type='dict', fields={k: _save(v, cache_dir, '{}.{}'.format(key, k), field)
+                                         for k, v in value.items()})
+    if isinstance(value, pd.Series) and np.issubdtype(value.dtype, np.datetime64):
+        np.save(os.path.join(cache_dir, key + '.npy'), value.values.astype('datetime64[ns]').view(np.int64))
+        return dict(type='datetime', file=key + '.npy')
+    if isinstance(value, LazyAudio):
+        # Decoded once, then memory-mapped:
+        value = value.read()
+    if isinstance(value, np.ndarray):
+        # Audio in float32, the positions and time tables are kept in double precision:
+        if np.issubdtype(value.dtype, np.floating) and field == 'data':
+            value = value.astype(np.float32)
+        np.save(os.path.join(cache_dir, key + '.npy'), value)
+        return dict(type='array', file=key + '.npy')
+    if isinstance(value, np.generic):
+        value = value.item()
+    return dict(type='value', value=value)
+
+
+def _load(layout, cache_dir):
+    if layout['type'] == 'namespace':
+        return Namespace(**{k: _load(v, cache_dir) for k, v in layout['fields'].items()})
+    if layout['type'] == 'dict':
+        return {k: _load(v, cache_dir) for k, v in layout['fields'].items()}
+    if layout['type'] == 'datetime':
+        return pd.Series(np.load(os.path.join(cache_dir, layout['file'])).view('datetime64[ns]'))
+    if layout['type'] == 'array':
+        return np.load(os.path.join(cache_dir, layout['file']), mmap_mode='r')
+    return layout['value']
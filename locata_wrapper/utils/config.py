@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+# Copyright 2019 Waseda University (Nelson Yalta)
+# Apache 2.0  (http://www.apache.org/licenses/LICENSE-2.0)
+
+from argparse import Namespace
+
+
+# Shortcuts for the algorithm config entry (both accept a precomputed STFT, inputs.stft):
+ALGORITHMS = dict(
+    music='locata_wrapper.algorithm.music:MUSIC',
+    root_music='locata_wrapper.algorithm.root_music:RootMUSIC',
+)
+
+
+def ConfigArgs(config):
+    """ConfigArgs
+
+    arguments of an experiment from its sacred config. Straight copy or use of prt for
+    the config generates error due to ReadOnlyList/Dict, to avoid problems for
+    multiprocessing these are converted to lists and dictionaries recursively.
+
+    Inputs:
+        config:     Sacred config of the experiment (_config)
+
+    Outputs:
+        args:       Namespace with the entries of the config (without the '__' entries)
+    """
+    args = Namespace()
+    for _value in [x for x in config if '__' not in x]:
+        setattr(args, _value, _copy_config(config[_value]))
+    return args
+
+
+def _copy_config(value):
+    if isinstance(value, dict):
+        return {k: _copy_config(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_copy_config(v) for v in value]
+    return value
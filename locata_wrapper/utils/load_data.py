@@ -9,46 +9,66 @@ import numpy as np
 import os
 import pandas as pd
 import python_speech_features  # NOQA
-import soundfile
 import sys
+import timeit
 
-from locata_wrapper.utils.shared import wrapToPi
+from locata_wrapper.utils.audio import LazyAudio
+from locata_wrapper.utils.cache import CachePath
+from locata_wrapper.utils.cache import LoadCache
+from locata_wrapper.utils.cache import SaveCache
+from locata_wrapper.utils.shared import cart2sph
 
 
-def cart2pol(cart):
-    """cart2pol
+def read_table(fname, log=logging):
+    """Read a LOCATA text table
+
+    The table is parsed once with explicit (float64) dtypes into a single matrix.
+
+    Inputs:
+        fname:      Path of the tab separated table with a header line
+
+    Outputs:
+        columns:    Dictionary column name: column index
+        table:      T x C matrix of values
+    """
+    start_time = timeit.default_timer()
+    with open(fname) as f:
+        header = f.readline().strip().split('\t')
+    table = pd.read_csv(fname, sep='\t', header=0, dtype={x: np.float64 for x in header}).to_numpy()
+    log.debug('Parsed {} ({} x {}) in {:.2f} ms'.format(
+        fname, table.shape[0], table.shape[1], (timeit.default_timer() - start_time) * 1e3))
+    return {x: i for i, x in enumerate(header)}, table
+
+
+def table_datetimes(columns, table):
+    """Timestamps of the year, month, day, hour, minute and second columns of a table
 
-    Cartesian to spherical transformation for LOCATA coordinate system
     Inputs:
-        x:      Cartesian x-position [m]
-        y:      Cartesian y-position [m]
-        z:      Cartesian z-position [m]
+        columns:    Dictionary column name: column index (see read_table)
+        table:      T x C matrix of values
 
     Outputs:
-        az:     Azimuth [rad]
-        el:     Elevation [rad]
-        rad:      Radius [m]
+        time:       pandas Series of T datetime64[ns] timestamps
     """
+    year, month, day, hour, minute = [table[:, columns[x]].astype(np.int64)
+                                      for x in ['year', 'month', 'day', 'hour', 'minute']]
+    months = (year - 1970) * 12 + month - 1
+    days = months.astype('datetime64[M]').astype('datetime64[D]') + (day - 1)
+    ns = (hour * 3600 + minute * 60) * 10 ** 9 + np.round(table[:, columns['second']] * 1e9).astype(np.int64)
+    return pd.Series(days.astype('datetime64[ns]') + ns.astype('timedelta64[ns]'))
 
-    pol = np.zeros(cart.shape)
-    x = cart[:, 0]
-    y = cart[:, 1]
-    z = cart[:, 2]
-    # radius
-    pol[:, 2] = np.sqrt(np.abs(x) ** 2 + np.abs(y) ** 2 + np.abs(z) ** 2)
-    # elev
-    pol[:, 1] = np.arccos(z / pol[:, 2])
-    # azimuth
-    pol[:, 0] = wrapToPi(np.arctan2(y, x) - (np.pi / 2))
-    return pol
 
+def _columns(columns, names):
+    return [columns[x] for x in names]
 
-def load_wav(fnames, obj_type):
+
+def load_wav(fnames, obj_type, log=logging):
     obj = Namespace()
     obj.data = dict()
     for this_wav in fnames:
-        # Load data:
-        data, fs = soundfile.read(this_wav)
+        # Lazy handle, the channels are decoded on access:
+        data = LazyAudio(this_wav)
+        fs = data.fs
 
         # Array name:
         this_obj = os.path.basename(this_wav).replace('.wav', '')
@@ -57,38 +77,35 @@ def load_wav(fnames, obj_type):
         # Load timestamps:
         _txt_table = this_wav.replace('{}.wav'.format(this_obj),
                                       'timestamps_{}.txt'.format(this_obj))
-        txt_table = np.loadtxt(_txt_table, delimiter='\t', skiprows=1).T
+        _, txt_table = read_table(_txt_table, log)
 
         # Copy to namespace:
         obj.fs = fs
         obj.data[str(this_obj)] = data
-        obj.time = txt_table
+        obj.time = txt_table.T
     return obj
 
 
-def load_txt(fnames, obj_type):
+def load_txt(fnames, obj_type, log=logging):
     obj = Namespace()
     obj.data = dict()
     for this_txt in fnames:
         # Load data:
-        txt_table = pd.read_csv(this_txt, sep='\t', header=0)
-        _time = txt_table[['year', 'month', 'day',
-                           'hour', 'minute', 'second']]
-        _pos = txt_table[['x', 'y', 'z']].values.T
-        _ref = txt_table[['ref_vec_x', 'ref_vec_y', 'ref_vec_z']].values.T
-        _rot_1 = txt_table[['rotation_11', 'rotation_12', 'rotation_13']].values
-        _rot_2 = txt_table[['rotation_21', 'rotation_22', 'rotation_23']].values
-        _rot_3 = txt_table[['rotation_31', 'rotation_32', 'rotation_33']].values
-        _rot = np.stack([_rot_1, _rot_2, _rot_3], axis=0)
-
-        mics = list(set([x.split('_')[0] for x in txt_table if 'mic' in x]))
-        if len(mics) > 0:
-            for i in range(len(mics)):
-                _lbl = ['mic{}_{}'.format(i + 1, x) for x in ['x', 'y', 'z']]
-                _data = txt_table[_lbl].values.T
-                if i == 0:
-                    _mic = np.zeros((3, _data.shape[1], len(mics)))
-                _mic[:, :, i] = _data
+        columns, txt_table = read_table(this_txt, log)
+        nsamples = txt_table.shape[0]
+        _pos = txt_table[:, _columns(columns, ['x', 'y', 'z'])].T
+        _ref = txt_table[:, _columns(columns, ['ref_vec_x', 'ref_vec_y', 'ref_vec_z'])].T
+        # 3 x T x 3, _rot[i, t, j] = rotation_ij of sample t:
+        _rot = txt_table[:, _columns(columns, ['rotation_{}{}'.format(i, j) for i in range(1, 4)
+                                               for j in range(1, 4)])]
+        _rot = _rot.reshape(nsamples, 3, 3).transpose(1, 0, 2)
+
+        # 3 x T x M microphone positions:
+        num_mics = len(set([x.split('_')[0] for x in columns if x.startswith('mic')]))
+        if num_mics > 0:
+            _mic = txt_table[:, _columns(columns, ['mic{}_{}'.format(i + 1, x) for i in range(num_mics)
+                                                   for x in ['x', 'y', 'z']])]
+            _mic = _mic.reshape(nsamples, num_mics, 3).transpose(2, 0, 1)
         else:
             _mic = None
 
@@ -97,7 +114,7 @@ def load_txt(fnames, obj_type):
         this_obj = this_obj.replace('{}_'.format(obj_type), '')
 
         # Copy to namespace:
-        obj.time = pd.to_datetime(_time)
+        obj.time = table_datetimes(columns, txt_table)
         obj.data[str(this_obj)] = Namespace(
             position=_pos, ref_vec=_ref, rotation=_rot,
             mic=_mic)
@@ -109,21 +126,29 @@ def LoadData(this_array, args=None, log=logging, is_dev=True):
 
     Inputs:
         dir_name:     Directory name containing LOCATA data (default: ../data/)
+        args:         Arguments of the experiment, if args.cache_dir is set the decoded data
+                      are cached there and memory-mapped on the next calls
 
     Outputs:
         audio_array:    Structure containing audio data recorded at each of the arrays
-        audio_source:   Structure containing clean speech data
+                        (LazyAudio handles, decoded on access)
+        audio_source:   Structure containing clean speech data (LazyAudio handles)
         position_array:   Structure containing positional information of each of the arrays
         position_source:  Structure containing positional information of each source
         required_time:    Structure containing the timestamps at which participants must provide estimates
     """
+    cache_dir = None
+    if getattr(args, 'cache_dir', None) is not None:
+        cache_dir = CachePath(this_array, args)
+        outputs = LoadCache(cache_dir, this_array, is_dev, log)
+        if outputs is not None:
+            log.info('Loaded {} from cache'.format(this_array))
+            return outputs
 
     # Time vector:
-    txt_array = pd.read_csv(os.path.join(this_array, 'required_time.txt'),
-                            sep='\t')
-    _time = pd.to_datetime(txt_array[['year', 'month', 'day',
-                                      'hour', 'minute', 'second']])
-    _valid = np.array(txt_array['valid_flag'].values, dtype=np.bool)
+    columns, txt_array = read_table(os.path.join(this_array, 'required_time.txt'), log)
+    _time = table_datetimes(columns, txt_array)
+    _valid = txt_array[:, columns['valid_flag']].astype(bool)
     required_time = Namespace(time=_time, valid_flag=_valid)
 
     # Audio files:
@@ -141,11 +166,11 @@ def LoadData(this_array, args=None, log=logging, is_dev=True):
             sys.exit(1)
 
     # Audio array data
-    audio_array = load_wav(audio_array_idx, 'audio_array')
+    audio_array = load_wav(audio_array_idx, 'audio_array', log)
 
     # Audio source data:
     if is_dev:
-        audio_source = load_wav(audio_source_idx, 'audio_source')
+        audio_source = load_wav(audio_source_idx, 'audio_source', log)
         audio_source.NS = len(audio_source.data)
     else:
         audio_source = None
@@ -154,16 +179,19 @@ def LoadData(this_array, args=None, log=logging, is_dev=True):
     txt_fnames = glob.glob(os.path.join(this_array, '*.txt'))
     if is_dev:
         position_source_idx = [x for x in txt_fnames if 'position_source' in x]
-        position_source = load_txt(position_source_idx, 'position_source')
+        position_source = load_txt(position_source_idx, 'position_source', log)
     else:
         position_source = None
 
     # Position array data:
     position_array_idx = [x for x in txt_fnames if 'position_array' in x]
-    position_array = load_txt(position_array_idx, 'position_array')
+    position_array = load_txt(position_array_idx, 'position_array', log)
 
     # Outputs:
-    return audio_array, audio_source, position_array, position_source, required_time
+    outputs = audio_array, audio_source, position_array, position_source, required_time
+    if cache_dir is not None:
+        SaveCache(cache_dir, this_array, outputs, is_dev)
+    return outputs
 
 
 def GetTruth(this_array, position_array, position_source, required_time, is_dev=True):
@@ -184,34 +212,46 @@ def GetTruth(this_array, position_array, position_source, required_time, is_dev=
                           Positional information about the sound sources are
                           only returned for the development datbase
                           (is_dev = 1).
+                          truth.array and truth.source[name] hold new read-only
+                          arrays, the input structures are not modified, and
+                          truth.polar_pos is the S x T x 3 stack of the azimuth,
+                          elevation and radius of the sources.
     """
-    truth = Namespace()
+    valid = np.asarray(required_time.valid_flag, dtype=bool)
 
-    # Specified array
-    truth.array = position_array.data[this_array]
-    for field in truth.array.__dict__:
-        _new_value = getattr(truth.array, field)[:, required_time.valid_flag]
-        setattr(truth.array, field, _new_value)
+    # Specified array (valid measurements only, every field has the time on its second axis)
+    truth = Namespace()
+    truth.array = _valid_fields(position_array.data[this_array], valid)
 
     # Source
     if is_dev:
-        frames = int(np.sum(required_time.valid_flag))
-        truth.source = position_source.data
         # All sources for this recording
+        sources = [_valid_fields(position_source.data[x], valid) for x in position_source.data]
 
-        for src_idx in truth.source:
-            for field in truth.source[src_idx].__dict__:
-                _new_value = getattr(truth.source[src_idx], field)
-                if _new_value is not None:
-                    setattr(truth.source[src_idx], field, _new_value[:, required_time.valid_flag])
+        # S x 3 x T positions relative to the microphone array:
+        h_p = np.stack([x.position for x in sources]) - truth.array.position[None]
 
-            # Azimuth and elevation relative to microphone array
-            h_p = truth.source[src_idx].position - truth.array.position
+        # Apply rotation of array to sources, pol_pos[s, t, j] = sum_i rotation_ij(t) h_p[s, i, t]
+        pol_pos = np.einsum('itj,sit->stj', truth.array.rotation, h_p)
 
-            # Apply rotation / translation of array to source
-            pol_pos = np.squeeze(np.matmul(truth.array.rotation.transpose(1, 2, 0), h_p.T[:, :, None]))
-
-            # Returned in azimuth, elevation & radius
-            truth.source[src_idx].polar_pos = cart2pol(pol_pos)
+        # Returned in azimuth, elevation & radius, S x T x 3
+        polar_pos = cart2sph(pol_pos)
+        polar_pos.flags.writeable = False
+        truth.polar_pos = polar_pos
+        truth.source = dict()
+        for idx, src_idx in enumerate(position_source.data):
+            sources[idx].polar_pos = polar_pos[idx]
+            truth.source[src_idx] = sources[idx]
 
     return truth
+
+
+def _valid_fields(data, valid):
+    """Copy of a position structure with the valid measurements only, as read-only arrays"""
+    fields = dict()
+    for field, value in vars(data).items():
+        if value is not None:
+            value = value[:, valid]
+            value.flags.writeable = False
+        fields[field] = value
+    return Namespace(**fields)
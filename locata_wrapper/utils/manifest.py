@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+# Copyright 2019 Waseda University (Nelson Yalta)
+# Apache 2.0  (http://www.apache.org/licenses/LICENSE-2.0)
+
+from argparse import Namespace
+import datetime
+import hashlib
+import inspect
+import json
+import logging
+import numpy as np
+import os
+import sys
+
+from locata_wrapper.utils.cache import SourceManifest
+
+# Version of the manifest layout, manifests of other versions are discarded
+MANIFEST_VERSION = 1
+
+# Settings which do not change the estimates (parallelism and diagnostics), not hashed
+UNHASHED_OPTIONS = ['workers', 'backend', 'keep_spectrum', 'memory_report']
+
+
+def _hash(value):
+    return hashlib.sha1(json.dumps(value, sort_keys=True, default=_jsonable).encode('utf-8')).hexdigest()
+
+
+def _jsonable(value):
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    if hasattr(value, '__dict__'):
+        return {k: v for k, v in vars(value).items() if k not in UNHASHED_OPTIONS}
+    return str(value)
+
+
+def InputFingerprint(array_dir):
+    """Hash of the names, sizes and modification times of the wav / txt files of a recording / array"""
+    return _hash(SourceManifest(array_dir))
+
+
+def OptionsFingerprint(opts, args):
+    """Hash of the settings structure and of the kind of database (parallelism and diagnostics excluded)"""
+    return _hash(dict(opts=opts, is_dev=bool(args.is_dev)))
+
+
+def AlgorithmFingerprint(algorithm):
+    """AlgorithmFingerprint
+
+    Inputs:
+        algorithm:  Localization function
+
+    Outputs:
+        import_path:    'module_name:function_name' of the algorithm
+        source_hash:    Hash of the source files of its module and of the modules of the same
+                        package it uses (recursively), so a change of a helper (e.g. the STFT)
+                        is a new version of the algorithm
+    """
+    module_name = algorithm.__module__
+    package = module_name.split('.')[0]
+    modules, pending = set(), [module_name]
+    while len(pending) > 0:
+        name = pending.pop()
+        if name in modules or name not in sys.modules:
+            continue
+        modules.add(name)
+        for value in vars(sys.modules[name]).values():
+            _name = value.__name__ if inspect.ismodule(value) else getattr(value, '__module__', None)
+            if isinstance(_name, str) and _name.split('.')[0] == package:
+                pending.append(_name)
+    sources = dict()
+    for name in sorted(modules):
+        try:
+            fname = inspect.getsourcefile(sys.modules[name])
+        except TypeError:
+            continue
+        if fname is not None and os.path.exists(fname):
+            with open(fname, 'rb') as f:
+                sources[name] = hashlib.sha1(f.read()).hexdigest()
+    return '{}:{}'.format(module_name, algorithm.__name__), _hash(sources)
+
+
+def ManifestKey(item):
+    """Key of a (task, recording, array) work item in the manifest"""
+    return 'task{}/recording{}/{}'.format(item.task, item.recording_id, item.array_name)
+
+
+def LoadManifest(results_dir, log=logging):
+    """LoadManifest
+
+    Inputs:
+        results_dir:    Results directory of the experiment
+
+    Outputs:
+        manifest:       Dictionary work item key: entry (see ManifestEntry), empty if there is
+                        no manifest (or of another version) in results_dir
+    """
+    fname = os.path.join(results_dir, 'manifest.json')
+    if not os.path.exists(fname):
+        return dict()
+    with open(fname) as f:
+        layout = json.load(f)
+    if layout.get('version') != MANIFEST_VERSION:
+        log.warning('Manifest {} of version {} is discarded'.format(fname, layout.get('version')))
+        return dict()
+    return layout['items']
+
+
+def SaveManifest(results_dir, manifest):
+    """Write the manifest to results_dir/manifest.json (written to a temporary file, then renamed)"""
+    tmp_fname = os.path.join(results_dir, 'manifest.json.tmp')
+    with open(tmp_fname, 'w') as f:
+        json.dump(dict(version=MANIFEST_VERSION, items=manifest), f, indent=1, sort_keys=True)
+    os.replace(tmp_fname, os.path.join(results_dir, 'manifest.json'))
+
+
+def RunFingerprint(algorithm, opts, args):
+    """Fingerprints of a run shared by its work items: algorithm, algorithm_hash and options_hash"""
+    import_path, source_hash = AlgorithmFingerprint(algorithm)
+    return Namespace(algorithm=import_path, algorithm_hash=source_hash, options_hash=OptionsFingerprint(opts, args))
+
+
+def ManifestEntry(item, fingerprint, summary, results_dir):
+    """ManifestEntry
+
+    Inputs:
+        item:           Work item (see ListWorkItems)
+        fingerprint:    Fingerprints of the run (see RunFingerprint)
+        summary:        Summary of the processed work item (see ProcessArray)
+        results_dir:    Results directory of the experiment
+
+    Outputs:
+        entry:          Dictionary with the fingerprints of the inputs, algorithm and options and
+                        the output paths (relative to results_dir) of the work item
+    """
+    return dict(task=item.task, recording_id=item.recording_id, array_name=item.array_name,
+                input_hash=InputFingerprint(item.array_dir), algorithm=fingerprint.algorithm,
+                algorithm_hash=fingerprint.algorithm_hash, options_hash=fingerprint.options_hash,
+                outputs=sorted(os.path.relpath(x, results_dir) for x in summary.outputs),
+                telapsed=summary.telapsed, completed=datetime.datetime.now().isoformat())
+
+
+def IsDone(manifest, item, fingerprint, results_dir):
+    """True if the entry of a work item matches the current inputs, algorithm and options and its outputs exist"""
+    entry = manifest.get(ManifestKey(item))
+    if entry is None:
+        return False
+    if any(entry.get(x) != getattr(fingerprint, x) for x in ['algorithm', 'algorithm_hash', 'options_hash']):
+        return False
+    if entry.get('input_hash') != InputFingerprint(item.array_dir):
+        return False
+    return all(os.path.exists(os.path.join(results_dir, x)) for x in entry['outputs'])
+
+
+def RemoveStaleOutputs(old_entry, new_entry, results_dir, log=logging):
+    """Delete the outputs of a previous entry which are not produced anymore (e.g. fewer sources)"""
+    if old_entry is None:
+        return
+    stale = set(old_entry.get('outputs', [])) - set(new_entry['outputs'])
+    # Deferred figures are not listed, they are removed with their results:
+    stale |= set(x.replace('.txt', '.png') for x in stale if x.endswith('.txt')) - set(new_entry['outputs'])
+    for x in stale:
+        fname = os.path.join(results_dir, x)
+        if os.path.exists(fname):
+            log.info('Removing stale output {}'.format(fname))
+            os.remove(fname)
+
+
+def PendingWorkItems(items, manifest, fingerprint, args, log=logging):
+    """PendingWorkItems
+
+    splits the work items of a run into the items to process and the items already done
+
+    Inputs:
+        items:          List of work items (see ListWorkItems)
+        manifest:       Manifest of the results directory (see LoadManifest)
+        fingerprint:    Fingerprints of the run (see RunFingerprint)
+        args:           Arguments of the experiment, every item is pending if args.resume is False
+
+    Outputs:
+        pending:        List of the work items to process
+        done:           List of the work items with current outputs
+    """
+    if not getattr(args, 'resume', True):
+        return list(items), list()
+    done = [x for x in items if IsDone(manifest, x, fingerprint, args.results_dir)]
+    pending = [x for x in items if x not in done]
+    if len(done) > 0:
+        log.info('Skipping {} work items with current results, {} to process'.format(len(done), len(pending)))
+    return pending, done
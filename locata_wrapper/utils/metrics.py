@@ -1,69 +1,136 @@
 # Copyright 2019 Waseda University (Nelson Yalta)
 # Apache 2.0  (http://www.apache.org/licenses/LICENSE-2.0)
 
+from argparse import Namespace
+import itertools
 import numpy as np
 from scipy.optimize import linear_sum_assignment
 
+from locata_wrapper.utils.shared import wrapToPi
 
-def CalculateContinueDOAScores(predicted_doa, true_doa, predicted_sed=None, true_sed=None):
-    nonNaN = ~np.isnan(predicted_doa)
-    predicted_doa[nonNaN] = 0.0
-    if predicted_sed is None:
-        # Consider all frames as good frames:
-        # n_good_frames = predicted_doa.shape[0]
-        # DOA loss w.r.t. predicted confidence
-        mae_azi = np.mean(np.abs(predicted_doa[:, 0] - true_doa[:, 0]))
-        mae_ele = np.mean(np.abs(predicted_doa[:, 1] - true_doa[:, 1]))
 
-        doa_loss = distance_between_gt_pred(true_doa, predicted_doa) / predicted_doa.shape[0]
+def CalculateContinueDOAScores(predicted_doa, true_doa, predicted_sed=None, true_sed=None, inclination=True):
+    """CalculateContinueDOAScores
 
-    else:
-        n_good_frames = 0
-    return mae_ele, mae_azi, doa_loss
+    DOA scores of frame-aligned trajectories, estimates and ground truth are paired within
+    each frame (see FrameDOAErrors). Frames without estimate (NaN) are not scored.
 
+    Inputs:
+        predicted_doa:  T x 2 (or T x N x 2) estimated azimuth and elevation [rad]
+        true_doa:       T x 2 (or T x S x 2) ground truth azimuth and elevation [rad]
+        predicted_sed:  T (or T x N) flags of active estimates (optional)
+        true_sed:       T (or T x S) flags of active sources (optional)
+        inclination:    Elevations are inclinations from the z axis, as in LOCATA and the outputs
+                        of MUSIC (True), or elevations from the horizontal plane (False)
 
-    
-# to delete later
-def distance_between_gt_pred(gt_list_rad, pred_list_rad):
+    Outputs:
+        mae_ele:        Mean absolute elevation error [rad]
+        mae_azi:        Mean absolute azimuth error (wrapped to [0, pi]) [rad]
+        doa_loss:       Mean angular distance between paired estimates and sources [deg]
     """
-    Shortest distance between two sets of spherical coordinates. Given a set of groundtruth spherical coordinates,
-     and its respective predicted coordinates, we calculate the spherical distance between each of the spherical
-     coordinate pairs resulting in a matrix of distances, where one axis represents the number of groundtruth
-     coordinates and the other the predicted coordinates. The number of estimated peaks need not be the same as in
-     groundtruth, thus the distance matrix is not always a square matrix. We use the hungarian algorithm to find the
-     least cost in this distance matrix.
-
-    :param gt_list_rad: list of ground-truth spherical coordinates
-    :param pred_list_rad: list of predicted spherical coordinates
-    :return: cost -  distance
-    :return: less - number of DOA's missed
-    :return: extra - number of DOA's over-estimated
+    errors = FrameDOAErrors(predicted_doa, true_doa, predicted_sed, true_sed, inclination=inclination)
+    with np.errstate(invalid='ignore'):
+        mae_azi = np.nanmean(errors.azimuth) if np.any(errors.assigned >= 0) else np.nan
+        mae_ele = np.nanmean(errors.elevation) if np.any(errors.assigned >= 0) else np.nan
+        doa_loss = np.nanmean(errors.distance) if np.any(errors.assigned >= 0) else np.nan
+    return mae_ele, mae_azi, doa_loss
+
+
+def FrameDOAErrors(predicted_doa, true_doa, predicted_sed=None, true_sed=None, max_permutation_size=4,
+                   inclination=True):
+    """FrameDOAErrors
+
+    pairs estimates and ground truth sources within each frame. The assignment with the
+    most pairs, then the smallest total angular distance, is found by enumerating the
+    permutations of the few sources of a frame, vectorized over all the frames, so the
+    cost grows linearly with the number of frames.
+
+    Inputs:
+        predicted_doa:  T x 2 (or T x N x 2) estimated azimuth and elevation [rad], NaN if missing
+        true_doa:       T x 2 (or T x S x 2) ground truth azimuth and elevation [rad], NaN if inactive
+        predicted_sed:  T (or T x N) flags of active estimates (optional)
+        true_sed:       T (or T x S) flags of active sources (optional)
+        max_permutation_size:   Above max(N, S) sources, each frame is solved with linear_sum_assignment
+        inclination:    Elevations are inclinations from the z axis, as in LOCATA and the outputs
+                        of MUSIC (True), or elevations from the horizontal plane (False). The
+                        angular distance is computed from elevations, the absolute elevation
+                        errors are the same for both conventions
+
+    Outputs:
+        errors:             Namespace containing
+        errors.assigned:    T x S index of the estimate paired with each source, -1 if none
+        errors.distance:    T x S angular distance to the paired estimate [deg], NaN if none
+        errors.azimuth:     T x S absolute azimuth error (wrapped to [0, pi]) [rad], NaN if none
+        errors.elevation:   T x S absolute elevation error [rad], NaN if none
+        errors.missed:      Vector of T numbers of active sources without estimate
+        errors.extra:       Vector of T numbers of estimates without source
     """
+    pred = _frame_doa(predicted_doa, predicted_sed)
+    true = _frame_doa(true_doa, true_sed)
+    if pred.shape[0] != true.shape[0]:
+        raise ValueError('Estimates and ground truth should have the same number of frames: {} != {}'.format(
+            pred.shape[0], true.shape[0]))
+    # At least one (missing) estimate and source per frame:
+    pred, true = [np.pad(x, [(0, 0), (0, int(x.shape[1] == 0)), (0, 0)], constant_values=np.nan) for x in [pred, true]]
+    nframes, nsrc, nest = true.shape[0], true.shape[1], pred.shape[1]
+    true_valid = ~np.any(np.isnan(true), axis=2)
+    pred_valid = ~np.any(np.isnan(pred), axis=2)
+
+    # T x S x N distances, pairs with an inactive side cost more than any set of valid pairs:
+    size = max(nsrc, nest)
+    # Elevations from the horizontal plane for the angular distance:
+    offset, sign = (np.pi / 2, -1) if inclination else (0, 1)
+    with np.errstate(invalid='ignore'):
+        dist = distance_between_spherical_coordinates_rad(true[:, :, None, 0], offset + sign * true[:, :, None, 1],
+                                                          pred[:, None, :, 0], offset + sign * pred[:, None, :, 1])
+    valid = true_valid[:, :, None] * pred_valid[:, None, :]
+    invalid_cost = 180. * size + 1.
+    cost = np.full([nframes, size, size], invalid_cost)
+    cost[:, :nsrc, :nest] = np.where(valid, dist, invalid_cost)
+
+    if size <= max_permutation_size:
+        perms = np.array(list(itertools.permutations(range(size))), dtype=int)
+        # T x P total cost of each permutation:
+        total = cost[:, np.arange(size), perms].sum(-1)
+        match = perms[np.argmin(total, axis=1)]
+    else:
+        match = np.zeros([nframes, size], dtype=int)
+        for t in range(nframes):
+            _, match[t] = linear_sum_assignment(cost[t])
 
-    gt_len, pred_len = gt_list_rad.shape[0], pred_list_rad.shape[0]
-    ind_pairs = np.array([[x, y] for y in range(pred_len) for x in range(gt_len)])
-    cost_mat = np.zeros((gt_len, pred_len))
+    # Estimate paired with each source, padded indexes and inactive pairs are unassigned:
+    assigned = match[:, :nsrc]
+    _t = np.arange(nframes)[:, None]
+    _s = np.arange(nsrc)[None, :]
+    _est = np.minimum(assigned, nest - 1)
+    paired = (assigned < nest) * valid[_t, _s, _est]
+    assigned = np.where(paired, assigned, -1)
 
-    # Slow implementation
-    # cost_mat = np.zeros((gt_len, pred_len))
-    # for gt_cnt, gt in enumerate(gt_list_rad):
-    #     for pred_cnt, pred in enumerate(pred_list_rad):
-    #         cost_mat[gt_cnt, pred_cnt] = distance_between_spherical_coordinates_rad(gt, pred)
+    distance = np.where(paired, dist[_t, _s, _est], np.nan)
+    azimuth = np.where(paired, np.abs(wrapToPi(pred[_t, _est, 0] - true[:, :, 0])), np.nan)
+    elevation = np.where(paired, np.abs(pred[_t, _est, 1] - true[:, :, 1]), np.nan)
+    missed = np.sum(true_valid * ~paired, axis=1)
+    extra = np.sum(pred_valid, axis=1) - np.sum(paired, axis=1)
+    return Namespace(assigned=assigned, distance=distance, azimuth=azimuth, elevation=elevation,
+                     missed=missed, extra=extra)
 
-    # Fast implementation
-    if gt_len and pred_len:
-        az1, ele1, az2, ele2 = gt_list_rad[ind_pairs[:, 0], 0], gt_list_rad[ind_pairs[:, 0], 1], \
-                               pred_list_rad[ind_pairs[:, 1], 0], pred_list_rad[ind_pairs[:, 1], 1]
-        cost_mat[ind_pairs[:, 0], ind_pairs[:, 1]] = distance_between_spherical_coordinates_rad(az1, ele1, az2, ele2)
 
-    row_ind, col_ind = linear_sum_assignment(cost_mat)
-    cost = cost_mat[row_ind, col_ind].sum()
-    return cost
+def _frame_doa(doa, sed=None):
+    """T x K x 2 copy of the DOA with NaN for the inactive entries"""
+    doa = np.array(doa, dtype=np.float64)
+    if doa.ndim == 2:
+        doa = doa[:, None, :]
+    doa = doa[..., :2]
+    if sed is not None:
+        sed = np.asarray(sed, dtype=bool).reshape(doa.shape[:2])
+        doa[~sed] = np.nan
+    return doa
 
 
 def distance_between_spherical_coordinates_rad(az1, ele1, az2, ele2):
     """
-    Angular distance between two spherical coordinates
+    Angular distance between two spherical coordinates, elevations (ele1, ele2) are measured
+    from the horizontal plane, not from the z axis
     MORE: https://en.wikipedia.org/wiki/Great-circle_distance
 
     :return: angular distance in degrees
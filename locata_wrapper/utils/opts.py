@@ -3,6 +3,7 @@
 # Apache 2.0  (http://www.apache.org/licenses/LICENSE-2.0)
 
 from argparse import Namespace
+import copy
 
 
 class InitalOptions():
@@ -39,3 +40,139 @@ class InitalOptions():
         self.dummy = Namespace(M=4)
 
         self.c = 340.0  # [m/s]
+
+        # MUSIC settings (overwritten by the `music` entry of the experiment config):
+        self.music = MUSICOptions()
+
+
+class MUSICOptions():
+    """MUSICOptions
+
+       settings of the MUSIC algorithm, every argument can be set from the
+       `music` dictionary of the experiment config
+
+       Inputs:
+           num_azimuth:       Number of azimuth points of the scan grid
+           azimuth_range:     [min, max] azimuth of the scan grid [deg]
+           num_elevation:     Number of elevation points of the scan grid
+           elevation_range:   [min, max] elevation of the scan grid [deg]
+           fft_point:         FFT length (and window length) of the STFT
+           frame_duration:    Frame duration [s]
+           hops_per_frame:    STFT hop size is frame_duration * fs // hops_per_frame
+           frames_per_block:  Number of STFT frames per MUSIC block
+           block_step:        Number of STFT frames between consecutive blocks
+           freq_band:         [min, max] frequency of the bins used [Hz] (bounds excluded)
+           band_dft:          Compute only the bins of freq_band (DFT restricted to the band)
+                              instead of the full FFT
+           stft_dtype:        Precision of the STFT, 'float32' or 'float64'
+           subarray:          Dictionary of array name: list of microphone indexes
+                              (None to use all mics), merged with the defaults
+           ref_mic:           Index in the subarray of the reference microphone
+           num_sources:       Number of sources estimated in each block
+           noise_dim:         Dimension of the noise subspace (None: number of mics - num_sources),
+                              num_sources and noise_dim are checked against the subarray by MUSIC
+           dtype:             Precision of the covariance and subspace stages,
+                              'complex64' or 'complex128'
+           covariance:        Block covariance estimator, 'sliding' (recursive) or 'direct'
+           search:            DOA search, 'grid' (scan grid only) or 'hierarchical' (coarse-to-fine
+                              refinement of the scan grid peaks)
+           refine_peaks:      Number of peaks of the scan grid refined by the hierarchical search
+           target_resolution: Resolution of the hierarchical search [deg]
+           front_azimuth:     Azimuth [deg] in front of a linear subarray for root-MUSIC, which only resolves
+                              the angle to the array axis: of the two mirrored solutions, the closest one is kept
+           pose:              Array pose of each block, 'nearest' (OptiTrack sample closest to the
+                              block center) or 'interpolate' (rotations interpolated by slerp and
+                              microphone positions linearly between the two samples around it)
+           workers:           Number of workers processing chunks of blocks of a recording in parallel
+           backend:           Workers of the chunks, 'thread' or 'process' (STFT and subspaces are
+                              shared through shared memory)
+           keep_spectrum:     Return the B x F x A x E pseudo-spectrum of the valid frequencies
+                              (out.spectrum) for diagnostics
+           memory_report:     Log the peak memory of the spectrum scan (tracemalloc)
+    """
+
+    def __init__(self, num_azimuth=73, azimuth_range=(-180., 180.),
+                 num_elevation=19, elevation_range=(0., 180.),
+                 fft_point=1024, frame_duration=0.03, hops_per_frame=4,
+                 frames_per_block=100, block_step=10, freq_band=(800., 1400.), band_dft=True, stft_dtype='float64',
+                 subarray=None, ref_mic=1, num_sources=1, noise_dim=None, dtype='complex128',
+                 covariance='sliding', search='grid', refine_peaks=3, target_resolution=1., front_azimuth=0.,
+                 pose='nearest', workers=1, backend='thread', keep_spectrum=False, memory_report=False):
+        # Scan grid: 5 dg azimuth and 10 dg elevation resolution by default
+        self.num_azimuth = int(num_azimuth)
+        self.azimuth_range = _pair(azimuth_range, 'azimuth_range')
+        self.num_elevation = int(num_elevation)
+        self.elevation_range = _pair(elevation_range, 'elevation_range')
+
+        # STFT and blocks:
+        self.fft_point = int(fft_point)
+        self.frame_duration = float(frame_duration)
+        self.hops_per_frame = int(hops_per_frame)
+        self.frames_per_block = int(frames_per_block)
+        self.block_step = int(block_step)
+
+        # Bandlimit signals to avoid spatial aliasing / low freq effects:
+        self.freq_band = _pair(freq_band, 'freq_band')
+        self.band_dft = bool(band_dft)
+        self.stft_dtype = str(stft_dtype)
+
+        # Microphones used for each array:
+        self.subarray = dict(dicit=[6, 7, 9], benchmark2=None, eigenmike=None, dummy=None)
+        for array_name, mics in dict(subarray or {}).items():
+            self.subarray[array_name] = None if mics is None else [int(x) for x in mics]
+        self.ref_mic = int(ref_mic)
+
+        # Subspace:
+        self.num_sources = int(num_sources)
+        self.noise_dim = None if noise_dim is None else int(noise_dim)
+        self.dtype = str(dtype)
+        self.covariance = str(covariance)
+
+        # DOA search:
+        self.search = str(search)
+        self.refine_peaks = int(refine_peaks)
+        self.target_resolution = float(target_resolution)
+        self.front_azimuth = float(front_azimuth)
+
+        # Array geometry of the blocks:
+        self.pose = str(pose)
+
+        # Parallel processing of the blocks:
+        self.workers = int(workers)
+        self.backend = str(backend)
+
+        # Diagnostics:
+        self.keep_spectrum = bool(keep_spectrum)
+        self.memory_report = bool(memory_report)
+
+        if min(self.num_azimuth, self.num_elevation, self.fft_point, self.hops_per_frame,
+               self.frames_per_block, self.block_step, self.refine_peaks, self.num_sources) < 1:
+            raise ValueError('Grid, STFT, block sizes, refine_peaks and num_sources should be positive integers')
+        if self.noise_dim is not None and self.noise_dim < 1:
+            raise ValueError('noise_dim should be a positive integer or None: {}'.format(self.noise_dim))
+        if self.workers < 1:
+            raise ValueError('workers should be a positive integer: {}'.format(self.workers))
+        if self.backend not in ['thread', 'process']:
+            raise ValueError('backend should be thread or process: {}'.format(self.backend))
+        if self.target_resolution <= 0:
+            raise ValueError('target_resolution should be positive: {}'.format(self.target_resolution))
+        if self.dtype not in ['complex64', 'complex128']:
+            raise ValueError('dtype should be complex64 or complex128: {}'.format(self.dtype))
+        if self.stft_dtype not in ['float32', 'float64']:
+            raise ValueError('stft_dtype should be float32 or float64: {}'.format(self.stft_dtype))
+        if self.covariance not in ['sliding', 'direct']:
+            raise ValueError('covariance should be sliding or direct: {}'.format(self.covariance))
+        if self.search not in ['grid', 'hierarchical']:
+            raise ValueError('search should be grid or hierarchical: {}'.format(self.search))
+        if self.pose not in ['nearest', 'interpolate']:
+            raise ValueError('pose should be nearest or interpolate: {}'.format(self.pose))
+
+    def to_dict(self):
+        return copy.deepcopy(self.__dict__)
+
+
+def _pair(value, name):
+    value = [float(x) for x in value]
+    if len(value) != 2 or value[0] > value[1]:
+        raise ValueError('{} should be a [min, max] pair: {}'.format(name, value))
+    return value
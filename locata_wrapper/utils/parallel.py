@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+# Copyright 2019 Waseda University (Nelson Yalta)
+# Apache 2.0  (http://www.apache.org/licenses/LICENSE-2.0)
+
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import numpy as np
+
+
+def block_chunks(nblocks, workers, align=1):
+    """Split a range of blocks into chunks
+
+    Inputs:
+        nblocks:    Number of blocks
+        workers:    Number of workers
+        align:      Chunks start at multiples of align blocks
+
+    Outputs:
+        chunks:     List of (srt, end) block ranges, end excluded
+    """
+    chunk_size = align * max(1, int(np.ceil(nblocks / float(workers * align))))
+    return [(srt, min(srt + chunk_size, nblocks)) for srt in range(0, nblocks, chunk_size)]
+
+
+def map_block_chunks(func, nblocks, inputs, outputs, workers=1, backend='thread', align=1, log=logging):
+    """Run a function over chunks of blocks on a pool of workers
+
+    func(inputs, outputs, srt, end) reads the dictionary of arrays inputs and writes the
+    blocks srt to end (excluded) of the dictionary of arrays outputs in place. With the
+    thread backend, the arrays are shared by the threads. With the process backend, they
+    are copied once to shared memory blocks, so they are not pickled for each chunk, and
+    func must be picklable (defined at module level).
+
+    Inputs:
+        func:       Function processing a chunk of blocks
+        nblocks:    Number of blocks
+        inputs:     Dictionary of input arrays
+        outputs:    Dictionary of output arrays, filled in place
+        workers:    Number of workers (1: func is called once with all the blocks)
+        backend:    'thread' or 'process'
+        align:      Chunks start at multiples of align blocks
+    """
+    chunks = block_chunks(nblocks, workers, align)
+    if workers <= 1 or len(chunks) <= 1:
+        func(inputs, outputs, 0, nblocks)
+        return
+    if backend == 'process':
+        try:
+            from multiprocessing import shared_memory  # NOQA
+        except ImportError:
+            log.warning('Shared memory requires python >= 3.8, using threads')
+            backend = 'thread'
+
+    if backend == 'thread':
+        with ThreadPoolExecutor(min(workers, len(chunks))) as pool:
+            list(pool.map(lambda chunk: func(inputs, outputs, *chunk), chunks))
+        return
+
+    from multiprocessing.shared_memory import SharedMemory
+    buffers = list()
+    try:
+        shared_inputs, shared_outputs = dict(), dict()
+        for arrays, shared in [(inputs, shared_inputs), (outputs, shared_outputs)]:
+            for name, value in arrays.items():
+                value = np.asarray(value)
+                shm = SharedMemory(create=True, size=max(value.nbytes, 1))
+                buffers.append(shm)
+                np.ndarray(value.shape, value.dtype, buffer=shm.buf)[...] = value
+                shared[name] = (shm.name, value.shape, value.dtype.str)
+        with ProcessPoolExecutor(min(workers, len(chunks))) as pool:
+            list(pool.map(_shared_chunk, [(func, shared_inputs, shared_outputs, srt, end) for srt, end in chunks]))
+        for name, (shm_name, shape, dtype) in shared_outputs.items():
+            shm = [x for x in buffers if x.name == shm_name][0]
+            outputs[name][...] = np.ndarray(shape, dtype, buffer=shm.buf)
+    finally:
+        for shm in buffers:
+            shm.close()
+            shm.unlink()
+
+
+def _shared_chunk(job):
+    """Attach the shared memory blocks of a chunk and run it (process backend)"""
+    from multiprocessing.shared_memory import SharedMemory
+    func, shared_inputs, shared_outputs, srt, end = job
+    buffers, arrays = list(), list()
+    try:
+        for shared in [shared_inputs, shared_outputs]:
+            arrays.append(dict())
+            for name, (shm_name, shape, dtype) in shared.items():
+                shm = SharedMemory(name=shm_name)
+                buffers.append(shm)
+                arrays[-1][name] = np.ndarray(shape, dtype, buffer=shm.buf)
+        func(arrays[0], arrays[1], srt, end)
+    finally:
+        # Views on the shared memory must be released before closing it:
+        arrays = None
+        for shm in buffers:
+            shm.close()
+
+
+def imap_work_items(func, items, processes, *args):
+    """Map a function over work items on a pool of processes
+
+    Inputs:
+        func:       Function called as func(item, *args)
+        items:      List of work items
+        processes:  Number of processes (1: the items are processed in order in this process)
+        args:       Additional arguments of func, shared by all the items
+
+    Outputs:
+        Yields the output of func for each item, as soon as it is completed (unordered with processes)
+    """
+    processes = min(processes, len(items))
+    if processes > 1:
+        from pathos.multiprocessing import ProcessingPool
+        pool = ProcessingPool(processes)
+        try:
+            # Unordered map, results are returned as they complete:
+            for output in pool.uimap(func, items, *[[x] * len(items) for x in args]):
+                yield output
+        finally:
+            pool.close()
+            pool.join()
+            pool.clear()
+    else:
+        for item in items:
+            yield func(item, *args)
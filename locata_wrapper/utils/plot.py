@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+# Copyright 2019 Waseda University (Nelson Yalta)
+# Apache 2.0  (http://www.apache.org/licenses/LICENSE-2.0)
+
+import glob
+import logging
+import numpy as np
+import os
+import pandas as pd
+
+from locata_wrapper.utils.load_data import GetTruth
+from locata_wrapper.utils.load_data import LoadData
+from locata_wrapper.utils.parallel import imap_work_items
+
+# Plotting modes: no figures, figures saved by ProcessArray or by PlotWorkItems after the run
+PLOT_MODES = ['off', 'inline', 'deferred']
+
+
+def decimated_waveform(y, max_points=20000, chunk_size=2 ** 18):
+    """Envelope of the channel average of a signal
+
+    The signal is read by chunks and reduced to the minimum and maximum of the
+    channel average over buckets of samples, so the plot has at most max_points points.
+
+    Inputs:
+        y:          N x M signal (or LazyAudio handle)
+        max_points: Maximum number of points of the envelope
+        chunk_size: Number of samples read at once
+
+    Outputs:
+        idx:        Sample index of each point
+        x:          Envelope (alternating minimum and maximum of each bucket)
+    """
+    num_samples = y.shape[0]
+    step = max(1, int(np.ceil(num_samples / float(max(1, max_points // 2)))))
+    chunk_size = step * max(1, chunk_size // step)
+    idx, x = list(), list()
+    for srt in range(0, num_samples, chunk_size):
+        data = np.average(np.asarray(y[srt:min(srt + chunk_size, num_samples)]), axis=1)
+        nbuckets = int(np.ceil(data.shape[0] / float(step)))
+        data = np.pad(data, (0, nbuckets * step - data.shape[0]), mode='edge').reshape(nbuckets, step)
+        idx.append(np.repeat(srt + np.arange(nbuckets) * step, 2))
+        x.append(np.stack([data.min(axis=1), data.max(axis=1)], axis=1).reshape(-1))
+    if len(x) == 0:
+        return np.zeros([0], dtype=int), np.zeros([0])
+    return np.concatenate(idx), np.concatenate(x)
+
+
+def PlotArray(item, args, log=logging, audio=None, fs=None, estimates=None, truth=None):
+    """PlotArray
+
+    saves the figure of each estimated source of a (task, recording, array) work item,
+    result_dir/source_<N>.png. Inputs which are not given are loaded from the database
+    and from the saved results (deferred plotting).
+
+    Inputs:
+        item:       Work item (see ListWorkItems)
+        args:       Arguments of the experiment
+        audio:      N x M signal of the array (optional)
+        fs:         Sampling frequency [Hz] (required with audio)
+        estimates:  List of pandas DataFrames with the azimuth and elevation of each source (optional)
+        truth:      Ground truth structure of GetTruth (optional, Dev database only)
+    """
+    # Figures are rendered without pyplot, matplotlib is only imported when plotting:
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+
+    this_task, recording_id, this_array = item.task, item.recording_id, item.array_name
+    result_dir = item.array_dir.replace(args.data_dir, args.results_dir)
+    if estimates is None:
+        fnames = glob.glob(os.path.join(result_dir, 'source_*.txt'))
+        fnames.sort(key=lambda x: int(os.path.basename(x)[len('source_'):-len('.txt')]))
+        estimates = [pd.read_csv(x, sep='\t') for x in fnames]
+    if audio is None or (truth is None and args.is_dev):
+        audio_array, _, position_array, position_source, required_time = LoadData(
+            item.array_dir, args, log, args.is_dev)
+        if audio is None:
+            audio, fs = audio_array.data[this_array], audio_array.fs
+        if truth is None and args.is_dev:
+            truth = GetTruth(this_array, position_array, position_source, required_time, args.is_dev)
+
+    x_len = audio.shape[0]
+    t_axis, x_axis = decimated_waveform(audio)
+    t_axis = t_axis / float(fs)
+
+    # Ground truth of the sources is only available for the development database:
+    _idx = [x for x in truth.source] if args.is_dev else []
+    for source_id, df in enumerate(estimates):
+        filename = os.path.join(result_dir, 'source_{}'.format(source_id + 1))
+        azu_x_pd = np.degrees(df[['azimuth']].values)
+        ele_x_pd = np.degrees(df[['elevation']].values)
+        pd_t = np.linspace(0, x_len / fs, azu_x_pd.shape[0])
+
+        fig = Figure(figsize=(4, 6))
+        FigureCanvasAgg(fig)
+        ax = fig.subplots(3)
+        fig.tight_layout(pad=2.0)
+        ax[0].plot(t_axis, x_axis)
+        ax[0].set_title(f'Task {this_task}, recording {recording_id}, array: {this_array}')
+        ax[0].set(xlabel='Time, $t$, [s]', ylabel='Amplitude')
+
+        # More sources can be estimated than there are in the ground truth
+        if source_id < len(_idx):
+            _source_id = _idx[source_id]
+            azu_x_gt = np.degrees(truth.source[_source_id].polar_pos[:, 0])
+            azu_t = np.linspace(0, x_len / fs, azu_x_gt.shape[0])
+            ele_x_gt = np.degrees(truth.source[_source_id].polar_pos[:, 1])
+            ele_t = np.linspace(0, x_len / fs, ele_x_gt.shape[0])
+            ax[1].plot(azu_t, azu_x_gt, '.b', label='groundtruth')
+            ax[2].plot(ele_t, ele_x_gt, '.b', label='groundtruth')
+
+        ax[1].plot(pd_t, azu_x_pd, 'xr', label='estimate')
+        ax[1].set(xlabel='Time, $t$, [s]', ylabel='Azimuth [deg]')
+        ax[1].legend()
+
+        ax[2].plot(pd_t, ele_x_pd, 'xr', label='estimate')
+        ax[2].set(xlabel='Time, $t$, [s]', ylabel='Elevation [deg]')
+        ax[2].legend()
+
+        fig.savefig(f'{filename}.png')
+
+
+def MissingPlots(items, args):
+    """Work items with results (source_N.txt) without figure (source_N.png)"""
+    missing = list()
+    for item in items:
+        result_dir = item.array_dir.replace(args.data_dir, args.results_dir)
+        fnames = glob.glob(os.path.join(result_dir, 'source_*.txt'))
+        if any(not os.path.exists(x.replace('.txt', '.png')) for x in fnames):
+            missing.append(item)
+    return missing
+
+
+def PlotWorkItems(items, args, log=logging):
+    """PlotWorkItems
+
+    saves the figures of processed work items from their saved results (deferred plotting)
+    on a pool of args.processes processes
+
+    Inputs:
+        items:      List of work items (see ListWorkItems)
+        args:       Arguments of the experiment
+    """
+    log.info('Plotting {} work items'.format(len(items)))
+    for _ in imap_work_items(PlotArray, items, getattr(args, 'processes', 1), args, log):
+        pass
@@ -3,143 +3,242 @@
 #  Apache 2.0  (http://www.apache.org/licenses/LICENSE-2.0)
 
 from argparse import Namespace
-import h5py
 import glob
 import logging
 import numpy as np
 import pandas as pd
 import os
+import soundfile
 import timeit
 
 from locata_wrapper.utils.check import CheckResults
 from locata_wrapper.utils.load_data import GetTruth
 from locata_wrapper.utils.load_data import LoadData
-from locata_wrapper.utils.metrics import CalculateContinueDOAScores
-
-from matplotlib import pyplot as plt
+from locata_wrapper.utils.parallel import imap_work_items
+from locata_wrapper.utils.plot import PlotArray
+from locata_wrapper.utils.profiling import Profiler
 
 
 def ElapsedTime(time_array):
-    n_steps = time_array.shape[0]
-    elapsed_time = np.zeros([n_steps])
-    for i in range(1, n_steps):
-        elapsed_time[i] = (time_array[i] - time_array[i - 1]).total_seconds()
-    return np.cumsum(elapsed_time)
+    """Elapsed time [s] of each timestamp since the first one"""
+    time_array = np.asarray(time_array, dtype='datetime64[ns]')
+    if time_array.shape[0] == 0:
+        return np.zeros([0])
+    return (time_array - time_array[0]) / np.timedelta64(1, 's')
 
 
-def ProcessTask(this_task, algorithm, opts, args, log=logging):
-    task_dir = os.path.join(args.data_dir, 'task{}'.format(this_task))
+def ListWorkItems(args, tasks=None, log=logging):
+    """ListWorkItems
 
-    # Create directory for this task in results directory:
-    # results_task_dir = os.path.join(args.results_dir,
-    #                                 'task{}'.format(this_task))
-    # os.makedirs(results_task_dir, exist_ok=True)
+    enumerates the (task, recording, array) work items of the database
 
-    # Read all recording IDs available for this task:
-    recordings = sorted(glob.glob(os.path.join(task_dir, '*')))
+    Inputs:
+        args:       Arguments of the experiment (data_dir, tasks, arrays)
+        tasks:      List of tasks (default: args.tasks)
 
-    # Parse through all recordings within this task:
-    for this_recording in recordings:
-        recording_id = int(this_recording.split('recording')[1])
+    Outputs:
+        items:      List of Namespaces (task, recording_id, array_name, array_dir, duration) sorted
+                    by decreasing audio duration [s], so the longest recordings are scheduled first
+    """
+    items = list()
+    for this_task in (args.tasks if tasks is None else tasks):
+        task_dir = os.path.join(args.data_dir, 'task{}'.format(this_task))
 
         # Read all recording IDs available for this task:
-        array_names = glob.glob(os.path.join(this_recording, '*'))
-        for array_dir in array_names:
-            this_array = os.path.basename(array_dir)
-            if this_array not in args.arrays:
-                continue
-            log.info('Processing task {}, recording {}, array {}.'.format(this_task, recording_id, this_array))
-            # Load data
-
-            # Load data from csv / wav files in database:
-            audio_array, audio_source, position_array, position_source, required_time = LoadData(
-                array_dir, args, log, args.is_dev)
-
-            log.info('Processing Complete!')
-
-            # Create directory for this array in results directory
-            result_dir = array_dir.replace(args.data_dir, args.results_dir)
-            os.makedirs(result_dir, exist_ok=True)
-
-            # Load signal
-            in_localization = Namespace()
-
-            # Get number of mics and mic array geometry:
-            in_localization.numMics = position_array.data[this_array].mic.shape[2]
-
-            # Signal and sampling frequency:
-            in_localization.y = audio_array.data[this_array]    # signal
-            in_localization.fs = audio_array.fs                 # sampling freq
-
-            # Users must provide estimates for each time stamp in in.timestamps
-
-            # Time stamps required for evaluation
-            in_localization.timestamps = ElapsedTime(required_time.time)[required_time.valid_flag]
-            in_localization.time = required_time.time[required_time.valid_flag]
-
-            # Extract ground truth
-
-            # position_array stores all optitrack measurements.
-            # Extract valid measurements only (specified by required_time.valid_flag).
-            truth = GetTruth(this_array, position_array, position_source, required_time, args.is_dev)
-
-            in_localization.array = truth.array
-            in_localization.array_name = this_array
-            in_localization.mic_geom = truth.array.mic
-
-            log.info('...Running localization using {}'.format(algorithm.__name__))
-            start_time = timeit.default_timer()
-            results = algorithm(in_localization, opts)
-
-            # results.telapsed = timeit.default_timer() - start_time
-
-            # Check results structure is provided in correct format
-            # CheckResults(results, in_localization, opts, log)
-            # Plots & Save results to file
-
-            log.info('Localization Complete!')
-            x_axis = np.average(audio_array.data[this_array], axis=1)
-            x_len = x_axis.shape[0]
-            fs = audio_array.fs 
-            t_axis = np.linspace(0, x_len / fs, x_len)
-
-            _idx = [x for x in truth.source]
-            for source_id in range(len(results.source)):
-                df = pd.DataFrame(results.source[source_id])
-                _source_id = _idx[source_id]
-                filename = os.path.join(result_dir, 'source_{}'.format(source_id + 1))
-                # mae_ele, mae_azi, doa_error = CalculateContinueDOAScores(df[['azimuth', 'elevation']].values, truth.source[_source_id].polar_pos[:, 0:2])
-                df.to_csv(f'{filename}.txt', index=False, sep='\t', encoding='utf-8')
-                # np.savetxt(os.path.join(result_dir, 'truth.txt'), truth.source[_source_id].polar_pos)
-
-                # Save figures to:
-                azu_x_pd = np.degrees(df[['azimuth']].values)
-                azu_x_gt = np.degrees(truth.source[_source_id].polar_pos[:, 0])
-                azu_t = np.linspace(0, x_len / fs, azu_x_gt.shape[0])
-
-                ele_x_pd = np.degrees(df[['elevation']].values)
-                ele_x_gt = np.degrees(truth.source[_source_id].polar_pos[:, 1])
-                ele_t = np.linspace(0, x_len / fs, ele_x_gt.shape[0])
-
-                fig, ax = plt.subplots(3, figsize=(4, 6))
-                fig.tight_layout(pad=2.0)
-                # plt.plot(azu_t, azu_x_gt, 'ob', azu_t, azu_x_pd, 'xr')
-                ax[0].plot(t_axis, x_axis)
-                ax[0].set_title(f'Task {this_task}, recording {recording_id}, array: {this_array}')
-                ax[0].set(xlabel='Time, $t$, [s]', ylabel='Amplitude')
-
-                ax[1].plot(azu_t, azu_x_gt, '.b', label='groundtruth')
-                ax[1].plot(azu_t, azu_x_pd, 'xr', label='estimate')
-                ax[1].set(xlabel='Time, $t$, [s]', ylabel='Azimuth [deg]')
-                ax[1].legend()
-
-                ax[2].plot(ele_t, ele_x_gt, '.b', label='groundtruth')
-                ax[2].plot(ele_t, ele_x_pd, 'xr', label='estimate')
-                ax[2].set(xlabel='Time, $t$, [s]', ylabel='Elevation [deg]')
-                ax[2].legend()
-
-                fig.savefig(f'{filename}.png')
-                # with open(os.path.join(result_dir, 'metrics.txt'), 'w') as f:
-                #     f.write('azimuth MAE (dg): {:.02f} \n'.format(np.degrees(mae_azi)))
-                #     f.write('elevation MAE (dg): {:.02f} \n'.format(np.degrees(mae_ele)))
-                #     f.write('DOA error: {:.02f} \n'.format(doa_error))
+        recordings = sorted(glob.glob(os.path.join(task_dir, '*')))
+        for this_recording in recordings:
+            recording_id = int(this_recording.split('recording')[1])
+
+            # Read all arrays available for this recording:
+            array_names = sorted(glob.glob(os.path.join(this_recording, '*')))
+            for array_dir in array_names:
+                this_array = os.path.basename(array_dir)
+                if this_array not in args.arrays:
+                    continue
+                # Duration from the header of the array audio file:
+                wav_fname = os.path.join(array_dir, 'audio_array_{}.wav'.format(this_array))
+                duration = soundfile.info(wav_fname).duration if os.path.exists(wav_fname) else 0.
+                items.append(Namespace(task=this_task, recording_id=recording_id, array_name=this_array,
+                                       array_dir=array_dir, duration=duration))
+    # Stable sort, items of the same duration keep the task / recording / array order:
+    items.sort(key=lambda x: -x.duration)
+    log.info('{} work items, {:.1f} s of audio'.format(len(items), sum([x.duration for x in items])))
+    return items
+
+
+def RunWorkItems(items, algorithm, opts, args, log=logging):
+    """RunWorkItems
+
+    processes work items on a pool of args.processes processes
+
+    Inputs:
+        items:      List of work items (see ListWorkItems)
+        algorithm:  Localization function
+        opts:       Settings structure generated by init()
+        args:       Arguments of the experiment
+
+    Outputs:
+        Yields the summary of each work item (see ProcessArray) as soon as it is completed
+    """
+    for summary in imap_work_items(ProcessArray, items, getattr(args, 'processes', 1), algorithm, opts, args, log):
+        yield summary
+
+
+def ProcessTask(this_task, algorithm, opts, args, log=logging):
+    """ProcessTask
+
+    processes all the recordings and arrays of a task
+
+    Inputs:
+        this_task:  Task number
+        algorithm:  Localization function
+        opts:       Settings structure generated by init()
+        args:       Arguments of the experiment
+
+    Outputs:
+        summaries:  List with the summary of each work item (see ProcessArray)
+    """
+    items = ListWorkItems(args, [this_task], log)
+    return [ProcessArray(item, algorithm, opts, args, log) for item in items]
+
+
+def LocalizationInputs(item, args, profiler, log=logging):
+    """LocalizationInputs
+
+    loads a (task, recording, array) work item and builds the input structure of the localization algorithm
+
+    Inputs:
+        item:       Work item (see ListWorkItems)
+        args:       Arguments of the experiment
+        profiler:   Profiler of the stages (see locata_wrapper.utils.profiling)
+
+    Outputs:
+        in_localization:    Input structure of the algorithm
+        truth:              Ground truth structure (see GetTruth)
+        audio_array:        Audio data of the arrays (see LoadData)
+    """
+    this_array, array_dir = item.array_name, item.array_dir
+
+    # Load data from csv / wav files in database:
+    with profiler.stage('load'):
+        audio_array, audio_source, position_array, position_source, required_time = LoadData(
+            array_dir, args, log, args.is_dev)
+
+    log.info('Processing Complete!')
+
+    # Load signal
+    in_localization = Namespace()
+
+    # Get number of mics and mic array geometry:
+    in_localization.numMics = position_array.data[this_array].mic.shape[2]
+
+    # Signal and sampling frequency:
+    in_localization.y = audio_array.data[this_array]    # signal
+    in_localization.fs = audio_array.fs                 # sampling freq
+
+    # Users must provide estimates for each time stamp in in.timestamps
+
+    # Time stamps required for evaluation
+    in_localization.timestamps = ElapsedTime(required_time.time)[required_time.valid_flag]
+    in_localization.time = required_time.time[required_time.valid_flag]
+
+    # Extract ground truth
+
+    # position_array stores all optitrack measurements.
+    # Extract valid measurements only (specified by required_time.valid_flag).
+    with profiler.stage('truth'):
+        truth = GetTruth(this_array, position_array, position_source, required_time, args.is_dev)
+
+    in_localization.array = truth.array
+    in_localization.array_name = this_array
+    in_localization.mic_geom = truth.array.mic
+    # The algorithm can time its own stages (see locata_wrapper.utils.profiling.GetProfiler):
+    in_localization.profiler = profiler
+    return in_localization, truth, audio_array
+
+
+def SaveEstimates(results, result_dir):
+    """SaveEstimates
+
+    writes the estimates of each source to result_dir/source_<N>.txt. The figures of previous
+    results (source_<N>.png) are deleted, they are saved again by the inline or deferred plotting
+
+    Inputs:
+        results:    Output structure of the localization algorithm
+        result_dir: Results directory of the recording / array
+
+    Outputs:
+        estimates:  List of pandas DataFrames of the estimates of each source
+        outputs:    List of the files written
+    """
+    os.makedirs(result_dir, exist_ok=True)
+    for fname in glob.glob(os.path.join(result_dir, 'source_*.png')):
+        os.remove(fname)
+    estimates, outputs = list(), list()
+    for source_id in range(len(results.source)):
+        df = pd.DataFrame(results.source[source_id])
+        filename = os.path.join(result_dir, 'source_{}'.format(source_id + 1))
+        df.to_csv(f'{filename}.txt', index=False, sep='\t', encoding='utf-8')
+        outputs.append(f'{filename}.txt')
+        estimates.append(df)
+    return estimates, outputs
+
+
+def ProcessArray(item, algorithm, opts, args, log=logging):
+    """ProcessArray
+
+    runs the localization algorithm on a (task, recording, array) work item and saves its results
+
+    Inputs:
+        item:       Work item (see ListWorkItems)
+        algorithm:  Localization function
+        opts:       Settings structure generated by init()
+        args:       Arguments of the experiment
+
+    Outputs:
+        summary:    Namespace (task, recording_id, array_name, result_dir, num_sources, telapsed,
+                    profile, outputs), profile is the list of the stage records of the Profiler
+                    and outputs the list of the files written
+    """
+    this_task, recording_id, this_array, array_dir = item.task, item.recording_id, item.array_name, item.array_dir
+    log.info('Processing task {}, recording {}, array {}.'.format(this_task, recording_id, this_array))
+    # Stages timed (and their peak memory traced with args.profile = 'memory'):
+    profile = getattr(args, 'profile', 'off')
+    profiler = Profiler(memory=profile == 'memory', log=log)
+
+    in_localization, truth, audio_array = LocalizationInputs(item, args, profiler, log)
+
+    # Create directory for this array in results directory
+    result_dir = array_dir.replace(args.data_dir, args.results_dir)
+
+    log.info('...Running localization using {}'.format(algorithm.__name__))
+    start_time = timeit.default_timer()
+    with profiler.stage('localization'):
+        results = algorithm(in_localization, opts)
+    results.telapsed = timeit.default_timer() - start_time
+
+    # Check results structure is provided in correct format
+    CheckResults(results, in_localization, opts, log)
+    # Plots & Save results to file
+
+    log.info('Localization Complete!')
+
+    with profiler.stage('write'):
+        estimates, outputs = SaveEstimates(results, result_dir)
+
+    # Save figures (deferred figures are saved by PlotWorkItems after the run):
+    if getattr(args, 'plots', 'inline') == 'inline':
+        with profiler.stage('plot'):
+            PlotArray(item, args, log, audio_array.data[this_array], audio_array.fs, estimates,
+                      truth if args.is_dev else None)
+        outputs += [x.replace('.txt', '.png') for x in outputs]
+
+    # Profile of the stages next to the results:
+    if profile != 'off':
+        profiler.save(os.path.join(result_dir, 'profile'), task=this_task, recording_id=recording_id,
+                      array_name=this_array, duration=item.duration, telapsed=results.telapsed)
+        outputs += [os.path.join(result_dir, 'profile.json'), os.path.join(result_dir, 'profile.csv')]
+
+    return Namespace(task=this_task, recording_id=recording_id, array_name=this_array, result_dir=result_dir,
+                     num_sources=len(results.source), telapsed=results.telapsed, profile=profiler.records(),
+                     outputs=outputs)
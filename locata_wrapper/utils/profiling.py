@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+# Copyright 2019 Waseda University (Nelson Yalta)
+# Apache 2.0  (http://www.apache.org/licenses/LICENSE-2.0)
+
+from collections import OrderedDict
+from contextlib import contextmanager
+import json
+import logging
+import os
+import pandas as pd
+import timeit
+import tracemalloc
+
+# Profiling modes: no profile files, stage timings, stage timings and peak memory (tracemalloc)
+PROFILE_MODES = ['off', 'time', 'memory']
+
+# Columns of the profile tables
+PROFILE_COLUMNS = ['stage', 'calls', 'seconds', 'peak_memory_mib']
+
+
+class Profiler(object):
+    """Profiler
+
+    Wall-clock time and, optionally, peak memory allocated (traced by tracemalloc) of the
+    stages of the pipeline. Stages are timed with the stage() context manager, they can be
+    nested and repeated (times are accumulated per stage name). The peak memory of a stage
+    is relative to the memory allocated when it starts and includes its nested stages.
+
+    Arguments:
+        memory:     Trace the peak memory of the stages
+        log:        Logger, stages are logged at debug level (info for memory traced stages)
+    """
+
+    def __init__(self, memory=False, log=logging):
+        self.memory = memory
+        self.log = log
+        self.stages = OrderedDict()
+        self._stack = list()
+
+    @contextmanager
+    def stage(self, name, memory=None):
+        """Time a stage
+
+        Inputs:
+            name:       Name of the stage
+            memory:     Trace the peak memory of the stage (None: setting of the profiler)
+        """
+        memory = self.memory if memory is None else memory
+        entry = dict(memory=memory, start_memory=0, peak=0, started=False)
+        if memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                entry['started'] = True
+            current, peak = tracemalloc.get_traced_memory()
+            # The peaks of the enclosing stages are kept before resetting it:
+            self._update_peaks(peak)
+            if hasattr(tracemalloc, 'reset_peak'):
+                tracemalloc.reset_peak()
+            entry['start_memory'] = current
+        self._stack.append(entry)
+        start_time = timeit.default_timer()
+        try:
+            yield
+        finally:
+            seconds = timeit.default_timer() - start_time
+            if memory:
+                _, peak = tracemalloc.get_traced_memory()
+                self._update_peaks(peak)
+            self._stack.pop()
+            if entry['started']:
+                tracemalloc.stop()
+            self.add(name, seconds, entry['peak'] - entry['start_memory'] if memory else None)
+
+    def _update_peaks(self, peak):
+        for entry in self._stack:
+            if entry['memory']:
+                entry['peak'] = max(entry['peak'], peak)
+
+    def add(self, name, seconds, peak_memory=None, calls=1):
+        """Record the time [s] and peak memory [bytes] of a stage measured elsewhere (e.g. by workers)"""
+        record = self.stages.setdefault(name, dict(calls=0, seconds=0., peak_memory=None))
+        record['calls'] += calls
+        record['seconds'] += seconds
+        if peak_memory is not None:
+            record['peak_memory'] = max(record['peak_memory'] or 0, peak_memory)
+        if peak_memory is None:
+            self.log.debug('{}: {:.3f} s'.format(name, seconds))
+        else:
+            self.log.info('{}: {:.3f} s, peak memory {:.1f} MiB'.format(name, seconds, peak_memory / 2 ** 20))
+
+    def seconds(self, name):
+        """Accumulated time [s] of a stage"""
+        return self.stages[name]['seconds'] if name in self.stages else 0.
+
+    def records(self):
+        """List of dictionaries (PROFILE_COLUMNS), one per stage in order of completion"""
+        return [dict(stage=name, calls=x['calls'], seconds=x['seconds'],
+                     peak_memory_mib=None if x['peak_memory'] is None else x['peak_memory'] / 2 ** 20)
+                for name, x in self.stages.items()]
+
+    def save(self, filename, **info):
+        """Write the profile to filename.json and filename.csv
+
+        Inputs:
+            filename:   Path of the profile without extension
+            info:       Additional fields of the json profile (e.g. task, recording_id)
+        """
+        records = self.records()
+        with open(filename + '.json', 'w') as f:
+            json.dump(dict(info, stages=records), f, indent=1)
+        pd.DataFrame(records, columns=PROFILE_COLUMNS).to_csv(filename + '.csv', index=False)
+
+
+def GetProfiler(inputs, log=logging):
+    """Profiler of the input structure of an algorithm (inputs.profiler), or a new one"""
+    profiler = getattr(inputs, 'profiler', None)
+    return Profiler(log=log) if profiler is None else profiler
+
+
+def SaveProfiles(summaries, results_dir, log=logging):
+    """SaveProfiles
+
+    writes the aggregate profile of a run, results_dir/profile.csv with the stages of every
+    work item and results_dir/profile_summary.csv with the total, mean and maximum time and
+    the maximum peak memory of each stage
+
+    Inputs:
+        summaries:      List of work item summaries with a profile (see ProcessArray)
+        results_dir:    Results directory of the experiment
+
+    Outputs:
+        summary:        pandas DataFrame of the summary per stage
+    """
+    rows = list()
+    for x in summaries:
+        for record in x.profile:
+            rows.append(OrderedDict([('task', x.task), ('recording_id', x.recording_id),
+                                     ('array_name', x.array_name)] + list(record.items())))
+    if len(rows) == 0:
+        return None
+    table = pd.DataFrame(rows)
+    table.to_csv(os.path.join(results_dir, 'profile.csv'), index=False)
+    summary = table.groupby('stage', sort=False).agg({'seconds': ['size', 'sum', 'mean', 'max'],
+                                                      'peak_memory_mib': 'max'})
+    summary.columns = ['items', 'total_seconds', 'mean_seconds', 'max_seconds', 'peak_memory_mib']
+    summary = summary.reset_index()
+    summary.to_csv(os.path.join(results_dir, 'profile_summary.csv'), index=False)
+    for _, x in summary.iterrows():
+        log.info('Profile {}: {:.3f} s total, {:.3f} s mean, {:.3f} s max'.format(
+            x['stage'], x['total_seconds'], x['mean_seconds'], x['max_seconds']))
+    return summary
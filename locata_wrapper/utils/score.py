@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+# Copyright 2019 Waseda University (Nelson Yalta)
+# Apache 2.0  (http://www.apache.org/licenses/LICENSE-2.0)
+
+import glob
+import logging
+import numpy as np
+import os
+import pandas as pd
+
+from locata_wrapper.utils.load_data import GetTruth
+from locata_wrapper.utils.load_data import LoadData
+from locata_wrapper.utils.metrics import FrameDOAErrors
+from locata_wrapper.utils.parallel import imap_work_items
+from locata_wrapper.utils.process import ElapsedTime
+
+# Columns of the score tables
+SCORE_COLUMNS = ['task', 'recording_id', 'array_name', 'source', 'frames', 'detected', 'missed', 'extra',
+                 'azimuth_mae', 'elevation_mae', 'doa_error']
+
+
+def LoadEstimates(result_dir, timestamps, log=logging):
+    """LoadEstimates
+
+    reads the source_N.txt files of a results directory
+
+    Inputs:
+        result_dir:     Results directory of a recording / array
+        timestamps:     Vector of T required timestamps [s] (valid ones)
+
+    Outputs:
+        doa:            T x N azimuth and elevation estimates [rad] of the N estimated sources,
+                        NaN where a source has no estimate
+    """
+    fnames = glob.glob(os.path.join(result_dir, 'source_*.txt'))
+    fnames.sort(key=lambda x: int(os.path.basename(x)[len('source_'):-len('.txt')]))
+    doa = np.full([timestamps.shape[0], len(fnames), 2], np.nan)
+    for src_idx, fname in enumerate(fnames):
+        df = pd.read_csv(fname, sep='\t', usecols=['timestamps', 'azimuth', 'elevation'], dtype=np.float64)
+        # Estimates are matched to the required timestamps, others are ignored:
+        est_ts = df['timestamps'].values
+        pos = np.clip(np.searchsorted(timestamps, est_ts), 0, max(timestamps.shape[0] - 1, 0))
+        prev = np.clip(pos - 1, 0, None)
+        pos = np.where(np.abs(timestamps[prev] - est_ts) < np.abs(timestamps[pos] - est_ts), prev, pos)
+        match = np.abs(timestamps[pos] - est_ts) < 1e-6 if timestamps.shape[0] > 0 else np.zeros(0, dtype=bool)
+        if not np.all(match):
+            log.warning('{}: {} estimates without required timestamp'.format(fname, np.sum(~match)))
+        doa[pos[match], src_idx] = df[['azimuth', 'elevation']].values[match]
+    return doa
+
+
+def ScoreArray(item, args, log=logging):
+    """ScoreArray
+
+    scores the saved results of a (task, recording, array) work item against the ground truth
+
+    Inputs:
+        item:       Work item (see ListWorkItems)
+        args:       Arguments of the experiment (data_dir, results_dir, cache_dir)
+
+    Outputs:
+        scores:     List of dictionaries (SCORE_COLUMNS), one per ground truth source,
+                    empty if the work item has no results
+    """
+    result_dir = item.array_dir.replace(args.data_dir, args.results_dir)
+    if len(glob.glob(os.path.join(result_dir, 'source_*.txt'))) == 0:
+        log.warning('No results for task {}, recording {}, array {}'.format(
+            item.task, item.recording_id, item.array_name))
+        return []
+
+    # Only the positions are used, the audio handles are not decoded:
+    _, _, position_array, position_source, required_time = LoadData(item.array_dir, args, log, True)
+    truth = GetTruth(item.array_name, position_array, position_source, required_time, True)
+    timestamps = ElapsedTime(required_time.time)[required_time.valid_flag]
+
+    return ScoreEstimates(item, truth, LoadEstimates(result_dir, timestamps, log))
+
+
+def ScoreEstimates(item, truth, pred_doa):
+    """ScoreEstimates
+
+    Inputs:
+        item:       Work item (see ListWorkItems)
+        truth:      Ground truth structure (see GetTruth)
+        pred_doa:   T x N azimuth and elevation estimates [rad] at the valid required timestamps,
+                    NaN where a source has no estimate (see LoadEstimates)
+
+    Outputs:
+        scores:     List of dictionaries (SCORE_COLUMNS), one per ground truth source
+    """
+    sources = list(truth.source)
+    # T x S, LOCATA elevations are inclinations from the z axis (see FrameDOAErrors):
+    true_doa = truth.polar_pos[:, :, :2].transpose(1, 0, 2)
+    errors = FrameDOAErrors(pred_doa, true_doa, inclination=True)
+
+    scores = list()
+    extra = int(np.sum(errors.extra))
+    for src_idx, source in enumerate(sources):
+        detected = errors.assigned[:, src_idx] >= 0
+        active = ~np.isnan(true_doa[:, src_idx, 0])
+        scores.append(dict(
+            task=item.task, recording_id=item.recording_id, array_name=item.array_name, source=source,
+            frames=int(np.sum(active)), detected=int(np.sum(detected)), missed=int(np.sum(active * ~detected)),
+            extra=extra, azimuth_mae=_mean(np.degrees(errors.azimuth[detected, src_idx])),
+            elevation_mae=_mean(np.degrees(errors.elevation[detected, src_idx])),
+            doa_error=_mean(errors.distance[detected, src_idx])))
+        # Extra estimates are counted once per recording:
+        extra = 0
+    return scores
+
+
+def ResultsDOA(results):
+    """T x N azimuth and elevation estimates [rad] of the output structure of a localization algorithm"""
+    return np.stack([np.stack([np.asarray(x['azimuth'], dtype=np.float64),
+                               np.asarray(x['elevation'], dtype=np.float64)], axis=1) for x in results.source], axis=1)
+
+
+def _mean(values):
+    return np.mean(values) if values.shape[0] > 0 else np.nan
+
+
+def RunScoreItems(items, args, log=logging):
+    """RunScoreItems
+
+    scores work items on a pool of args.processes processes
+
+    Inputs:
+        items:      List of work items (see ListWorkItems)
+        args:       Arguments of the experiment
+
+    Outputs:
+        Yields the scores of each work item (see ScoreArray) as soon as it is completed
+    """
+    for scores in imap_work_items(ScoreArray, items, getattr(args, 'processes', 1), args, log):
+        yield scores
+
+
+def SummarizeScores(scores):
+    """SummarizeScores
+
+    aggregates the scores of several recordings / sources
+
+    Inputs:
+        scores:     pandas DataFrame with SCORE_COLUMNS
+
+    Outputs:
+        summary:    Dictionary with the total frames, detected, missed and extra counts and the
+                    mean errors over all the detected frames (weighted by the detected frames)
+    """
+    summary = {x: int(scores[x].sum()) for x in ['frames', 'detected', 'missed', 'extra']}
+    weights = scores['detected'].values
+    for x in ['azimuth_mae', 'elevation_mae', 'doa_error']:
+        values = np.nan_to_num(scores[x].values)
+        summary[x] = np.sum(values * weights) / np.sum(weights) if np.sum(weights) > 0 else np.nan
+    return summary
+
+
+def SaveScores(scores, results_dir, log=logging):
+    """SaveScores
+
+    writes one table per task and array, results_dir/task<N>/scores_<array>.txt,
+    with a row per recording and source and a last row 'all' aggregating them
+
+    Inputs:
+        scores:     List of score dictionaries (see ScoreArray)
+        results_dir:    Results directory of the experiment
+
+    Outputs:
+        tables:     Dictionary (task, array_name): pandas DataFrame of the table
+    """
+    tables = dict()
+    if len(scores) == 0:
+        return tables
+    scores = pd.DataFrame(scores, columns=SCORE_COLUMNS).sort_values(['task', 'array_name', 'recording_id', 'source'])
+    for (this_task, this_array), table in scores.groupby(['task', 'array_name']):
+        summary = SummarizeScores(table)
+        summary.update(task=this_task, recording_id='all', array_name=this_array, source='all')
+        table = pd.concat([table, pd.DataFrame([summary], columns=SCORE_COLUMNS)], ignore_index=True)
+        filename = os.path.join(results_dir, 'task{}'.format(this_task), 'scores_{}.txt'.format(this_array))
+        table.to_csv(filename, index=False, sep='\t', encoding='utf-8', float_format='%.4f')
+        log.info('Task {}, array {}: azimuth MAE {:.2f} deg, elevation MAE {:.2f} deg, DOA error {:.2f} deg, '
+                 '{}/{} frames detected -> {}'.format(
+                     this_task, this_array, summary['azimuth_mae'], summary['elevation_mae'],
+                     summary['doa_error'], summary['detected'], summary['frames'], filename))
+        tables[(this_task, this_array)] = table
+    return tables
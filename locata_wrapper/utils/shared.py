@@ -7,17 +7,138 @@
 import numpy as np
 
 
-def wrapTo2Pi(_lambda):
-    """Wrap angle in radians to [0 pi]"""
-    positiveInput = _lambda > 0
-    _lambda = np.mod(_lambda, 2 * np.pi)
-    _idx = (_lambda == 0) * positiveInput
-    _lambda[_idx] = 2 * np.pi
-    return _lambda
+def _float(value):
+    # Integer angles are converted to float64, float32 is kept
+    return value if value.dtype.kind == 'f' else value.astype(np.result_type(value.dtype, np.float32))
 
 
-def wrapToPi(_lambda):
-    """Wrap angle in radians to [-pi pi]"""
+def _result(out):
+    # 0-d results are returned as scalars
+    return out[()] if out.ndim == 0 else out
+
+
+def _mod2pi(_lambda):
+    """np.mod(_lambda, 2 * pi) with positive multiples of 2pi mapped to 2pi, in a new array
+
+    Angles within [-4pi 4pi] (differences of wrapped angles, shifted azimuths) are wrapped
+    by adding the multiple of 2pi, exact as fmod (Sterbenz lemma) and much faster.
+    """
+    if np.any(np.abs(_lambda) > 4 * np.pi):
+        result = np.fmod(_lambda, 2 * np.pi)
+        result += np.multiply((result < 0) + (result == 0) * (_lambda > 0), 2 * np.pi, dtype=result.dtype)
+        return result
+    shift = (_lambda < 0).view(np.int8) + (_lambda < -2 * np.pi).view(np.int8) - (_lambda > 2 * np.pi).view(np.int8)
+    return _lambda + np.multiply(shift, 2 * np.pi, dtype=_lambda.dtype)
+
+
+def wrapTo2Pi(_lambda, out=None):
+    """Wrap angle in radians to [0 2pi]
+
+    Positive multiples of 2pi are mapped to 2pi and NaN are passed through.
+
+    Inputs:
+        _lambda:    Array of angles [rad] (float32 or float64)
+        out:        Array in which to place the result (can be _lambda), a new array by default
+
+    Outputs:
+        _lambda:    Wrapped angles (out if given)
+    """
+    _lambda = np.asarray(_lambda)
+    wrapped = _mod2pi(_float(_lambda))
+    if out is None:
+        return _result(wrapped)
+    np.copyto(out, wrapped)
+    return _result(out)
+
+
+def wrapToPi(_lambda, out=None):
+    """Wrap angle in radians to [-pi pi]
+
+    Angles within [-pi pi] are returned unchanged and NaN are passed through.
+
+    Inputs:
+        _lambda:    Array of angles [rad] (float32 or float64)
+        out:        Array in which to place the result (can be _lambda), a new array by default
+
+    Outputs:
+        _lambda:    Wrapped angles (out if given)
+    """
+    _lambda = _float(np.asarray(_lambda))
     q = (_lambda < -np.pi) + (np.pi < _lambda)
-    _lambda[q] = wrapTo2Pi(_lambda[q] + np.pi) - np.pi
-    return _lambda
+    wrapped = _mod2pi(_lambda + np.pi)
+    wrapped -= np.pi
+    if out is None:
+        return _result(np.where(q, wrapped, _lambda))
+    np.copyto(out, np.where(q, wrapped, _lambda))
+    return _result(out)
+
+
+def cart2sph(cart, axis=-1, out=None):
+    """Cartesian to spherical transformation for LOCATA coordinate system
+
+    az = 0 is the y-axis and the elevation is the inclination from the z-axis.
+
+    Inputs:
+        cart:   Array of x, y, z positions [m] along axis (any number of other dimensions)
+        axis:   Axis of the coordinates (of size 3)
+        out:    Array in which to place the result, a new array by default
+
+    Outputs:
+        sph:    Array of azimuth [rad], elevation [rad] and radius [m] along axis,
+                NaN elevation for the origin
+    """
+    cart = np.asarray(cart)
+    if cart.shape[axis] != 3:
+        raise ValueError('cart2sph expects x, y, z coordinates on axis {}: {}'.format(axis, cart.shape))
+    if out is None:
+        out = np.empty(cart.shape, dtype=np.result_type(cart.dtype, np.float32))
+    elif np.may_share_memory(out, cart):
+        cart = cart.copy()
+    x, y, z = np.moveaxis(cart, axis, 0)
+    az, el, rad = np.moveaxis(out, axis, 0)
+
+    # radius
+    np.sqrt(x * x + y * y + z * z, out=rad)
+    # elev
+    with np.errstate(invalid='ignore', divide='ignore'):
+        np.arccos(z / rad, out=el)
+    # azimuth
+    np.arctan2(y, x, out=az)
+    az -= np.pi / 2
+    wrapToPi(az, out=az)
+    return out
+
+
+def sph2cart(sph, axis=-1, out=None):
+    """Spherical to cartesian transformation for LOCATA coordinate system (inverse of cart2sph)
+
+    Inputs:
+        sph:    Array of azimuth [rad], elevation [rad] and, optionally, radius [m] along axis
+                (unit vectors without radius)
+        axis:   Axis of the coordinates (of size 2 or 3)
+        out:    Array in which to place the result, a new array by default
+
+    Outputs:
+        cart:   Array of x, y, z positions [m] along axis
+    """
+    sph = np.asarray(sph)
+    if sph.shape[axis] not in [2, 3]:
+        raise ValueError('sph2cart expects azimuth, elevation (and radius) on axis {}: {}'.format(axis, sph.shape))
+    shape = list(sph.shape)
+    shape[axis] = 3
+    if out is None:
+        out = np.empty(shape, dtype=np.result_type(sph.dtype, np.float32))
+    elif np.may_share_memory(out, sph):
+        sph = sph.copy()
+    coords = np.moveaxis(sph, axis, 0)
+    x, y, z = np.moveaxis(out, axis, 0)
+
+    sin_el = np.sin(coords[1])
+    if coords.shape[0] == 3:
+        sin_el *= coords[2]
+    np.multiply(-sin_el, np.sin(coords[0]), out=x)
+    np.multiply(sin_el, np.cos(coords[0]), out=y)
+    np.cos(coords[1], out=z)
+    if coords.shape[0] == 3:
+        z *= coords[2]
+    return out
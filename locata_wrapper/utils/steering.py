@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+# Copyright 2019 Waseda University (Nelson Yalta)
+# Apache 2.0  (http://www.apache.org/licenses/LICENSE-2.0)
+
+from argparse import Namespace
+from collections import OrderedDict
+import hashlib
+import numpy as np
+import threading
+
+from locata_wrapper.utils.shared import sph2cart
+
+
+def direction_vectors(az, el):
+    """Unit direction vectors of an azimuth / elevation scan grid
+
+    [2] eq (8.35) (references in locata_wrapper.algorithm.music) modified s.th.
+    az = 0 and el = pi/2 result in eta = [0 1 0], i.e., pointing along y-axis.
+
+    Inputs:
+        az:     Vector of A azimuth angles [rad]
+        el:     Vector of E elevation angles [rad]
+
+    Outputs:
+        eta:    3 x A x E tensor of direction vectors
+    """
+    _az, _el = np.meshgrid(az, el, indexing='ij')
+    return sph2cart(np.stack([_az, _el]), axis=0)
+
+
+def steering_vectors(eta, freq, rotation, mics, ref_mic, c):
+    """Far-field steering vectors of a scan grid
+
+    Inputs:
+        eta:        3 x A x E tensor of direction vectors (see direction_vectors)
+        freq:       Vector of F frequencies [Hz]
+        rotation:   3 x 3 rotation matrix of the array
+        mics:       3 x M matrix of microphone positions
+        ref_mic:    Position of the reference microphone
+        c:          Speed of sound [m/s]
+
+    Outputs:
+        SV:         F x M x A x E tensor of steering vectors
+    """
+    rot_eta = np.einsum('ij,jae->iae', rotation, eta)
+
+    # [2] eq (8.36) - TDoA:
+    tau = 1 / c * np.einsum('iae,im->mae', rot_eta, mics - np.reshape(ref_mic, [3, 1]))
+
+    # [2] eq (8.34) - Steering vector:
+    return np.exp(1j * 2 * np.pi * freq[:, None, None, None] * tau[None])
+
+
+def _digest(*arrays):
+    sha = hashlib.sha1()
+    for x in arrays:
+        x = np.ascontiguousarray(x)
+        sha.update(str(x.shape).encode())
+        sha.update(x.tobytes())
+    return sha.hexdigest()
+
+
+class SteeringCache(object):
+    """SteeringCache
+
+    Bounded LRU cache of steering tables. The steering vectors depend only on the
+    array geometry at a given OptiTrack sample, the scan grid and the frequency
+    bins, so for a static array the table is built once per recording instead of
+    once per block.
+
+    Arguments:
+        maxsize:    Maximum number of tables kept in memory
+    """
+
+    def __init__(self, maxsize=8):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._tables = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._tables)
+
+    def get(self, array_name, subarray, ref_mic, rotation, mics, az, el, freq, c):
+        """Steering table of the scan grid
+
+        Inputs:
+            array_name:     String containing array name
+            subarray:       Indexes of the microphones used
+            ref_mic:        Index in subarray of the reference microphone
+            rotation:       3 x 3 rotation matrix of the array
+            mics:           3 x M matrix with the positions of all the microphones of the array
+            az:             Vector of azimuth angles of the scan grid [rad]
+            el:             Vector of elevation angles of the scan grid [rad]
+            freq:           Vector of frequencies [Hz]
+            c:              Speed of sound [m/s]
+
+        Outputs:
+            SV:             F x len(subarray) x A x E (read-only) tensor of steering vectors
+        """
+        subarray = np.asarray(subarray)
+        key = (array_name, tuple(subarray.tolist()), int(ref_mic), _digest(rotation, mics),
+               _digest(az, el), _digest(freq), float(c))
+        with self._lock:
+            if key in self._tables:
+                self.hits += 1
+                self._tables.move_to_end(key)
+                return self._tables[key]
+            self.misses += 1
+
+        # Computed without the lock, so the workers of other blocks are not blocked:
+        SV = steering_vectors(direction_vectors(az, el), freq, rotation, mics[:, subarray],
+                              mics[:, subarray[ref_mic]], c)
+        SV.flags.writeable = False
+        with self._lock:
+            # Another worker may have stored the same table meanwhile:
+            if key in self._tables:
+                self._tables.move_to_end(key)
+                return self._tables[key]
+            self._tables[key] = SV
+            while len(self._tables) > self.maxsize:
+                self._tables.popitem(last=False)
+            return SV
+
+    def clear(self):
+        with self._lock:
+            self._tables.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        return Namespace(hits=self.hits, misses=self.misses, size=len(self._tables), maxsize=self.maxsize)
+
+
+# Shared by every MUSIC call of this process
+steering_cache = SteeringCache()
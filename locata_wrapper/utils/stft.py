@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+# Copyright 2019 Waseda University (Nelson Yalta)
+# Apache 2.0  (http://www.apache.org/licenses/LICENSE-2.0)
+
+import numpy as np
+from numpy.lib.stride_tricks import as_strided
+from scipy.signal import get_window
+
+
+def fft_frequencies(fs, n_fft):
+    """Center frequencies of the FFT bins
+
+    Inputs:
+        fs:         Sampling frequency [Hz]
+        n_fft:      FFT length
+
+    Outputs:
+        freq:       Vector of 1 + n_fft // 2 frequencies [Hz]
+    """
+    return np.linspace(0, float(fs) / 2, 1 + n_fft // 2)
+
+
+def samples_to_time(samples, fs):
+    """Time of sample indexes [s]"""
+    return np.asanyarray(samples) / float(fs)
+
+
+def frame_signal(y, n_fft, hop_length):
+    """Frames of a multichannel signal
+
+    Inputs:
+        y:          N x M signal (samples x channels)
+        n_fft:      Frame length
+        hop_length: Number of samples between consecutive frames
+
+    Outputs:
+        frames:     T x n_fft x M (read-only) view of the T full frames of y
+    """
+    y = np.asarray(y)
+    num_frames = max(0, 1 + (y.shape[0] - n_fft) // hop_length)
+    frames = as_strided(y, shape=(num_frames, n_fft) + y.shape[1:],
+                        strides=(hop_length * y.strides[0],) + y.strides)
+    frames.flags.writeable = False
+    return frames
+
+
+def dft(frames, window, bins=None, dtype=np.float64, chunk_size=256):
+    """Windowed DFT of multichannel frames
+
+    With bins, only these bins are computed by multiplying the frames with the
+    corresponding rows of the DFT matrix, which is cheaper than the FFT for narrow bands.
+    Frames are processed by chunks to bound the size of the windowed copies.
+
+    Inputs:
+        frames:     T x n_fft x M frames (see frame_signal)
+        window:     Vector of n_fft window samples
+        bins:       Indexes of the F bins computed (None: all the 1 + n_fft // 2 bins)
+        dtype:      Precision of the computation, float32 or float64
+        chunk_size: Number of frames processed at once
+
+    Outputs:
+        X:          T x F x M spectra (complex64 for float32, complex128 otherwise)
+    """
+    dtype = np.dtype(dtype)
+    cdtype = np.result_type(dtype, np.complex64)
+    n_fft = frames.shape[1]
+    num_bins = 1 + n_fft // 2 if bins is None else len(bins)
+    X = np.empty((frames.shape[0], num_bins) + frames.shape[2:], dtype=cdtype)
+    window = np.asarray(window, dtype=dtype)
+    if bins is not None:
+        # DFT matrix of the bins with the window folded in, F x n_fft:
+        phase = -2 * np.pi * np.outer(bins, np.arange(n_fft)) / n_fft
+        w_real = (np.cos(phase) * window).astype(dtype)
+        w_imag = (np.sin(phase) * window).astype(dtype)
+    else:
+        window = window.reshape((n_fft,) + (1,) * (frames.ndim - 2))
+    for srt in range(0, frames.shape[0], chunk_size):
+        data = frames[srt:srt + chunk_size].astype(dtype, copy=False)
+        if bins is None:
+            X[srt:srt + chunk_size] = np.fft.rfft(data * window, axis=1)
+        else:
+            data = data.reshape(data.shape[0], n_fft, -1)
+            _X = X[srt:srt + chunk_size].reshape(data.shape[0], num_bins, -1)
+            _X.real = np.matmul(w_real, data)
+            _X.imag = np.matmul(w_imag, data)
+    return X
+
+
+def stft(y, n_fft, hop_length, window='hamming', bins=None, dtype=np.float64):
+    """Multichannel short-time Fourier transform
+
+    All the channels are framed at once. Frames are centered on the samples
+    0, hop_length, ... with reflect padding of the signal, as librosa.stft.
+
+    Inputs:
+        y:          N x M signal (samples x channels)
+        n_fft:      FFT length (and window length)
+        hop_length: Number of samples between consecutive frames
+        window:     Window name or vector of n_fft samples
+        bins:       Indexes of the bins computed (None: all the 1 + n_fft // 2 bins)
+        dtype:      Precision of the computation, float32 or float64
+
+    Outputs:
+        X:          T x F x M spectra (frames x frequencies x channels)
+    """
+    if isinstance(window, str):
+        window = get_window(window, n_fft, fftbins=True)
+    pad = [(n_fft // 2, n_fft // 2)] + [(0, 0)] * (np.ndim(y) - 1)
+    y = np.pad(np.asarray(y, dtype=dtype), pad, mode='reflect')
+    return dft(frame_signal(y, n_fft, hop_length), window, bins, dtype)
@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+# Copyright 2019 Waseda University (Nelson Yalta)
+# Apache 2.0  (http://www.apache.org/licenses/LICENSE-2.0)
+
+from argparse import Namespace
+from collections import OrderedDict
+import copy
+import itertools
+import logging
+import numpy as np
+import os
+import pandas as pd
+import timeit
+
+from locata_wrapper.algorithm.music import band_bins
+from locata_wrapper.algorithm.music import music_stft
+from locata_wrapper.algorithm.music import music_subarray
+from locata_wrapper.algorithm.music import stft_key
+from locata_wrapper.utils.check import CheckResults
+from locata_wrapper.utils.opts import MUSICOptions
+from locata_wrapper.utils.parallel import imap_work_items
+from locata_wrapper.utils.process import LocalizationInputs
+from locata_wrapper.utils.process import SaveEstimates
+from locata_wrapper.utils.profiling import Profiler
+from locata_wrapper.utils.score import ResultsDOA
+from locata_wrapper.utils.score import SaveScores
+from locata_wrapper.utils.score import ScoreEstimates
+from locata_wrapper.utils.score import SummarizeScores
+
+
+def SweepConfigs(music, grid):
+    """SweepConfigs
+
+    enumerates the MUSIC configurations of a parameter grid
+
+    Inputs:
+        music:      Dictionary with the base settings of MUSIC (see MUSICOptions)
+        grid:       Dictionary setting name: list of values, every combination of values is a
+                    configuration, enumerated in the order of the grid (an empty grid gives the
+                    base settings only)
+
+    Outputs:
+        configs:    List of Namespaces (name, params, music), name is config<N>, params the
+                    dictionary of the values of the grid and music the MUSICOptions
+    """
+    keys = list(grid)
+    combinations = list(itertools.product(*[grid[x] for x in keys]))
+    width = len(str(len(combinations) - 1))
+    configs = list()
+    for idx, values in enumerate(combinations):
+        params = OrderedDict(zip(keys, values))
+        settings = dict(music)
+        settings.update(params)
+        configs.append(Namespace(name='config{:0{}d}'.format(idx, width), params=params,
+                                 music=MUSICOptions(**settings)))
+    return configs
+
+
+def SweepArray(item, algorithm, opts, configs, args, log=logging):
+    """SweepArray
+
+    runs every configuration on a (task, recording, array) work item. The data and the
+    ground truth are loaded once, and the STFT is computed once for each group of
+    configurations with the same STFT settings (covering all their subarrays and bands,
+    see locata_wrapper.algorithm.music.music_stft), then passed to the algorithm as inputs.stft.
+    The results of a configuration are saved in results_dir/<config name>.
+
+    Inputs:
+        item:       Work item (see ListWorkItems)
+        algorithm:  Localization function accepting inputs.stft (MUSIC, RootMUSIC)
+        opts:       Settings structure generated by init()
+        configs:    List of configurations (see SweepConfigs)
+        args:       Arguments of the experiment
+
+    Outputs:
+        summary:    Namespace (task, recording_id, array_name, frontends, rows, profile), rows is a
+                    list of dictionaries (config, telapsed, scores), profile the records of the shared stages
+    """
+    log.info('Sweeping task {}, recording {}, array {}.'.format(item.task, item.recording_id, item.array_name))
+    profiler = Profiler(log=log)
+    in_localization, truth, _ = LocalizationInputs(item, args, profiler, log)
+    fs = in_localization.fs
+
+    # Configurations sharing an STFT:
+    frontends = OrderedDict()
+    for config in configs:
+        frontends.setdefault(stft_key(config.music, fs), list()).append(config)
+
+    rows = list()
+    for group in frontends.values():
+        channels = np.unique(np.concatenate([
+            music_subarray(item.array_name, in_localization.numMics, x.music, log) for x in group]))
+        bins = np.unique(np.concatenate([band_bins(fs, x.music) for x in group]))
+        with profiler.stage('stft'):
+            in_localization.stft = music_stft(in_localization.y, fs, channels, bins, group[0].music)
+
+        for config in group:
+            config_opts = copy.copy(opts)
+            config_opts.music = config.music
+            in_localization.profiler = Profiler(log=log)
+            start_time = timeit.default_timer()
+            results = algorithm(in_localization, config_opts)
+            results.telapsed = timeit.default_timer() - start_time
+            CheckResults(results, in_localization, config_opts, log)
+
+            result_dir = item.array_dir.replace(args.data_dir, os.path.join(args.results_dir, config.name))
+            SaveEstimates(results, result_dir)
+            scores = ScoreEstimates(item, truth, ResultsDOA(results)) if args.is_dev else []
+            rows.append(dict(config=config.name, telapsed=results.telapsed, scores=scores))
+        del in_localization.stft
+
+    return Namespace(task=item.task, recording_id=item.recording_id, array_name=item.array_name,
+                     frontends=len(frontends), rows=rows, profile=profiler.records())
+
+
+def RunSweepItems(items, algorithm, opts, configs, args, log=logging):
+    """RunSweepItems
+
+    sweeps the configurations over work items on a pool of args.processes processes
+
+    Inputs:
+        items:      List of work items (see ListWorkItems)
+        algorithm:  Localization function
+        opts:       Settings structure generated by init()
+        configs:    List of configurations (see SweepConfigs)
+        args:       Arguments of the experiment
+
+    Outputs:
+        Yields the summary of each work item (see SweepArray) as soon as it is completed
+    """
+    for summary in imap_work_items(SweepArray, items, getattr(args, 'processes', 1), algorithm, opts, configs,
+                                   args, log):
+        yield summary
+
+
+def SaveComparison(summaries, configs, results_dir, log=logging):
+    """SaveComparison
+
+    writes the score tables of each configuration (results_dir/<config name>, see SaveScores)
+    and the comparison table results_dir/comparison.csv, one row per configuration with the
+    values of the grid, the time of the algorithm [s] and the scores over all the work items
+
+    Inputs:
+        summaries:      List of work item summaries (see SweepArray)
+        configs:        List of configurations (see SweepConfigs)
+        results_dir:    Results directory of the sweep
+
+    Outputs:
+        comparison:     pandas DataFrame of the comparison table
+    """
+    rows = list()
+    for config in configs:
+        config_rows = [x for summary in summaries for x in summary.rows if x['config'] == config.name]
+        scores = [x for row in config_rows for x in row['scores']]
+        row = OrderedDict(config=config.name)
+        row.update((k, str(v) if isinstance(v, (list, tuple, dict)) else v) for k, v in config.params.items())
+        row['seconds'] = sum([x['telapsed'] for x in config_rows])
+        if len(scores) > 0:
+            SaveScores(scores, os.path.join(results_dir, config.name), log)
+            row.update(SummarizeScores(pd.DataFrame(scores)))
+        rows.append(row)
+    comparison = pd.DataFrame(rows)
+    comparison.to_csv(os.path.join(results_dir, 'comparison.csv'), index=False, float_format='%.4f')
+    shared = sum([x['seconds'] for summary in summaries for x in summary.profile])
+    log.info('Shared stages (load, truth, STFT): {:.3f} s, algorithm: {:.3f} s'.format(
+        shared, comparison['seconds'].sum()))
+    for _, x in comparison.iterrows():
+        log.info('{}: {}'.format(x['config'], ', '.join(
+            ['{}={:.4g}'.format(k, v) if isinstance(v, float) else '{}={}'.format(k, v)
+             for k, v in x.items() if k != 'config'])))
+    return comparison
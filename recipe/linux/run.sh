@@ -23,4 +23,8 @@ set -o pipefail
 
 eval_loc.py -l ${verbose} \
             with ${config_file} \
-            processes=${process}
\ No newline at end of file
+            processes=${process}
+
+score_loc.py -l ${verbose} \
+             with ${config_file} \
+             processes=${process}
@@ -28,6 +28,10 @@ python %ROOT_DIR%\locata_wrapper\bin\eval_loc.py -l %VERBOSE% ^
                                                     with %CONFIG_FILE% ^
                                                     processes=%PROCESS%
 
+python %ROOT_DIR%\locata_wrapper\bin\score_loc.py -l %VERBOSE% ^
+                                                     with %CONFIG_FILE% ^
+                                                     processes=%PROCESS%
+
 
 :eof
 echo run.bat Done.
@@ -39,7 +39,6 @@ setup(
     packages = find_packages(include = ['locata_wrapper*']),
     python_requires= '>=3.6',
     install_requires = [
-        'librosa',
         'pandas>=0.24.0',
         'pathos>=0.2.0',
         'pymongo>=3.0.0',
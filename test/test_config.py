@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+# Copyright 2019 Waseda University (Nelson Yalta)
+# Apache 2.0  (http://www.apache.org/licenses/LICENSE-2.0)
+
+from sacred.config.custom_containers import ReadOnlyDict
+from sacred.config.custom_containers import ReadOnlyList
+
+from locata_wrapper.utils.config import ConfigArgs
+
+
+def test_config_args_nested_copy():
+    config = ReadOnlyDict(dict(
+        tasks=ReadOnlyList([1, 2]),
+        music=ReadOnlyDict(dict(subarray=ReadOnlyDict(dict(dicit=ReadOnlyList([6, 7, 9]))))),
+        sweep=ReadOnlyList([ReadOnlyDict(dict(freq_band=ReadOnlyList([ReadOnlyList([500, 4000])])))]),
+        __doc__='experiment'))
+    args = ConfigArgs(config)
+    assert sorted(vars(args)) == ['music', 'sweep', 'tasks']
+    assert type(args.tasks) is list and type(args.music) is dict and type(args.music['subarray']) is dict
+    assert type(args.music['subarray']['dicit']) is list
+    assert type(args.sweep[0]) is dict and type(args.sweep[0]['freq_band'][0]) is list
+
+    # Nested entries are not shared with the config:
+    args.music['subarray']['dicit'].append(8)
+    args.sweep[0]['freq_band'][0][0] = 800
+    assert list(config['music']['subarray']['dicit']) == [6, 7, 9]
+    assert config['sweep'][0]['freq_band'][0][0] == 500
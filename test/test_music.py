@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+# Copyright 2019 Waseda University (Nelson Yalta)
+# Apache 2.0  (http://www.apache.org/licenses/LICENSE-2.0)
+
+from argparse import Namespace
+import numpy as np
+import pandas as pd
+import pytest
+
+from locata_wrapper.algorithm.music import band_bins
+from locata_wrapper.algorithm.music import MUSIC
+from locata_wrapper.algorithm.music import pseudo_spectrum
+from locata_wrapper.algorithm.streaming_music import StreamingMUSIC
+from locata_wrapper.utils.opts import InitalOptions
+from locata_wrapper.utils.steering import direction_vectors
+
+
+def make_inputs(azimuth=40., elevation=90., duration=1.5, opti_duration=2., fs=16000, c=343., seed=0):
+    """Plane wave of white noise on a static 4-mic square array (array name 'dummy')
+
+    The OptiTrack samples (10 Hz) cover opti_duration seconds, past the end of the audio by default.
+    """
+    mics = 0.1 * np.array([[-1., 1., 1., -1.], [-1., -1., 1., 1.], [0., 0., 0., 0.]]) / 2
+    eta = direction_vectors(np.radians([azimuth]), np.radians([elevation]))[:, 0, 0]
+    # Delays relative to the reference mic (1), see locata_wrapper.utils.steering.steering_vectors:
+    tau = np.dot(eta, mics - mics[:, 1:2]) / c
+    num_samples = int(duration * fs)
+    S = np.fft.rfft(np.random.RandomState(seed).randn(num_samples))
+    freq = np.fft.rfftfreq(num_samples, 1. / fs)
+    y = np.fft.irfft(S[:, None] * np.exp(1j * 2 * np.pi * freq[:, None] * tau[None]), n=num_samples, axis=0)
+
+    timestamps = np.arange(0, opti_duration, 0.1)
+    array = Namespace(rotation=np.repeat(np.eye(3)[:, None], timestamps.shape[0], axis=1),
+                      mic=np.repeat(mics[:, None], timestamps.shape[0], axis=1))
+    time = pd.Series(pd.Timestamp('2019-01-01') + pd.to_timedelta(timestamps, unit='s'))
+    return Namespace(y=y, fs=fs, timestamps=timestamps, time=time, array=array, array_name='dummy')
+
+
+def test_music_pose_interpolate_past_last_frame():
+    inputs = make_inputs()
+    opts = InitalOptions()
+    assert inputs.timestamps[-1] > inputs.y.shape[0] / inputs.fs
+
+    nearest = MUSIC(inputs, opts)
+    opts.music.pose = 'interpolate'
+    interpolated = MUSIC(inputs, opts)
+    # Static array, the interpolated poses are the measured ones:
+    for key in ['azimuth', 'elevation']:
+        np.testing.assert_array_equal(interpolated.source[0][key], nearest.source[0][key])
+    azimuth = interpolated.source[0]['azimuth']
+    assert np.all(np.abs(np.degrees(azimuth[np.isfinite(azimuth)]) - 40.) <= 5.)
+
+
+@pytest.mark.parametrize('subarray, settings, match', [
+    ([0, 1, 2], dict(num_sources=3), 'num_sources'),
+    ([0, 1, 2], dict(num_sources=4), 'num_sources'),
+    ([0, 1, 2], dict(noise_dim=5), 'noise_dim'),
+    (None, dict(num_sources=2, noise_dim=3), 'noise_dim'),
+])
+def test_music_subspace_dimensions(subarray, settings, match):
+    inputs = make_inputs()
+    opts = InitalOptions()
+    opts.music.subarray['dummy'] = subarray
+    for key, value in settings.items():
+        setattr(opts.music, key, value)
+    with pytest.raises(ValueError, match=match):
+        MUSIC(inputs, opts)
+    with pytest.raises(ValueError, match=match):
+        StreamingMUSIC('dummy', inputs.fs, inputs.array.rotation[:, 0], inputs.array.mic[:, 0], opts)
+
+
+def test_music_largest_subspace_dimensions():
+    opts = InitalOptions()
+    opts.music.num_sources = 3
+    opts.music.noise_dim = 1
+    out = MUSIC(make_inputs(), opts)
+    assert len(out.source) == 3
+
+
+def test_pseudo_spectrum_empty_noise_subspace():
+    with pytest.raises(ValueError, match='noise subspace'):
+        pseudo_spectrum(np.zeros([2, 4, 0], dtype=complex), np.ones([2, 4, 3, 1], dtype=complex))
+
+
+@pytest.mark.parametrize('dtype', ['complex64', 'complex128'])
+def test_pseudo_spectrum_finite(dtype):
+    # Steering vectors in the signal subspace are orthogonal to the noise subspace:
+    Un = np.eye(4, dtype=dtype)[None, :, 2:]
+    SV = np.eye(4, dtype=dtype)[None, :, :, None]
+    power = pseudo_spectrum(Un, SV)
+    assert np.all(np.isfinite(power)) and np.all(power[0, :2] > power[0, 2:])
+    assert np.isfinite(power.sum(0, dtype=np.float64)).all()
+
+
+@pytest.mark.parametrize('freq_band', [(800., 1400.), (500., 4000.), (0., 8000.)])
+def test_streaming_music_band_bins(freq_band):
+    inputs = make_inputs()
+    opts = InitalOptions()
+    opts.music.freq_band = freq_band
+    stream = StreamingMUSIC('dummy', inputs.fs, inputs.array.rotation[:, 0], inputs.array.mic[:, 0], opts)
+    np.testing.assert_array_equal(stream.freq_idx, band_bins(inputs.fs, opts.music))
@@ -0,0 +1,23 @@
+# -*- coding: utf-8 -*-
+# Copyright 2019 Waseda University (Nelson Yalta)
+# Apache 2.0  (http://www.apache.org/licenses/LICENSE-2.0)
+
+import pytest
+
+from locata_wrapper.utils.opts import MUSICOptions
+
+
+@pytest.mark.parametrize('settings', [
+    dict(num_sources=0),
+    dict(num_sources=-1),
+    dict(noise_dim=0),
+    dict(noise_dim=-2),
+])
+def test_music_options_non_positive(settings):
+    with pytest.raises(ValueError):
+        MUSICOptions(**settings)
+
+
+def test_music_options_noise_dim_default():
+    assert MUSICOptions().noise_dim is None
+    assert MUSICOptions(noise_dim=2).noise_dim == 2